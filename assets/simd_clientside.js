@@ -0,0 +1,152 @@
+// Clientside callbacks for simd_dashboard.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    simd: {
+        // SIMD_CLIENTSIDE mode: the same figures as update_figures in
+        // simd_dashboard.py, computed from the per-council counts table
+        update_figures: function(deprv_label, domain_rank, share_label,
+                                 map_lod, map_mode, rank_cutoff, compare_with,
+                                 uncertainty, table) {
+            var counts = table.counts[deprv_label][domain_rank];
+            var total = counts.reduce(function(a, b) { return a + b; }, 0);
+            var rows = table.councils.map(function(council, i) {
+                var share = share_label === 'local_share' ?
+                    counts[i] * 100 / table.totals[i] : counts[i] * 100 / total;
+                return {council: council, share: Math.round(share * 10) / 10};
+            });
+            rows.sort(function(a, b) { return b.share - a.share; });
+            var x = rows.map(function(row) { return row.council; });
+            var y = rows.map(function(row) { return row.share; });
+
+            var bar = JSON.parse(JSON.stringify(table.bar));
+            bar.data[0].x = x;
+            bar.data[0].y = y;
+            bar.data[0].name = share_label.replace('_', ' ');
+            var values = [deprv_label, domain_rank, share_label];
+            bar.layout.title.text = table.title.replace(/\{\}/g, function() {
+                return values.shift();
+            });
+
+            var map = JSON.parse(JSON.stringify(table.map));
+            var trace = map.data[0];
+            trace.locations = x;
+            trace.z = y;
+            if (table.geojson) {
+                trace.geojson = table.geojson[map_lod || 0];
+            }
+            trace.marker = Object.assign({}, trace.marker,
+                {opacity: map_mode === 'datazones' ? 0 : 0.6});
+            trace.showscale = map_mode !== 'datazones';
+            return [bar, map, x];
+        },
+
+        // SIMD_FIGURE_API mode: the figures of update_figures fetched by GET
+        // from the figure API, so the browser or a proxy can cache them.
+        // Dash waits for the returned promise
+        fetch_figures: function(deprv_label, domain_rank, share_label,
+                                map_lod, map_mode, rank_cutoff, compare_with,
+                                uncertainty, api) {
+            var params = {deprv_label: deprv_label, domain_rank: domain_rank,
+                          share_label: share_label, map_lod: map_lod,
+                          map_mode: map_mode};
+            // left out unless they matter, so equal views share one URL
+            if (deprv_label === api.custom) {
+                params.rank_cutoff = rank_cutoff;
+            }
+            if (compare_with) {
+                params.compare_with = compare_with;
+            } else if (uncertainty !== 'exact') {
+                params.uncertainty = uncertainty;
+            }
+            params.v = api.version;
+            return fetch(api.url + '?' + new URLSearchParams(params))
+                .then(function(response) {
+                    if (!response.ok) {
+                        throw new Error('figure API: ' + response.status);
+                    }
+                    return response.json();
+                })
+                .then(function(data) {
+                    return [data.bar_share.figure, data.map.figure,
+                            data.figure_councils.data];
+                });
+        },
+
+        // the export URLs of the current view for the download links
+        export_links: function(deprv_label, domain_rank, share_label,
+                               rank_cutoff, compare_with, links) {
+            var view = {deprv_label: deprv_label, domain_rank: domain_rank,
+                        share_label: share_label, rank_cutoff: rank_cutoff,
+                        compare_with: compare_with};
+            var query = Object.keys(view).filter(function(key) {
+                return view[key] !== null && view[key] !== undefined;
+            }).map(function(key) {
+                return key + '=' + encodeURIComponent(view[key]);
+            }).join('&');
+            return links.map(function(link) {
+                return link.url + '?rows=' + link.rows + '&format=' +
+                    link.format + '&' + query;
+            });
+        },
+
+        // the domain whose data zone ranks the map needs, left unchanged
+        // while the council map is shown so the server is not asked
+        zone_domain: function(domain_rank, map_mode, current) {
+            if (map_mode !== 'datazones' || domain_rank === current) {
+                return window.dash_clientside.no_update;
+            }
+            return domain_rank;
+        },
+
+        // colours the data zone vector tiles by joining each tile feature's
+        // row number 'i' to the compact rank array sent by the server
+        paint_datazones: function(zones, figure, map_mode) {
+            var graph = document.getElementById('map');
+            var gd = graph && graph.querySelector('.js-plotly-plot');
+            var mapbox = gd && gd._fullLayout && gd._fullLayout.mapbox;
+            if (!mapbox || !mapbox._subplot || !mapbox._subplot.map.isStyleLoaded()) {
+                // the figure is not drawn yet, try again shortly
+                setTimeout(function() {
+                    window.dash_clientside.simd.paint_datazones(zones, figure,
+                                                                map_mode);
+                }, 200);
+                return window.dash_clientside.no_update;
+            }
+            var map = mapbox._subplot.map;
+            if (!zones || map_mode !== 'datazones') {
+                if (map.getLayer('datazones')) {
+                    map.setLayoutProperty('datazones', 'visibility', 'none');
+                }
+                return '';
+            }
+            if (!map.getSource('datazones')) {
+                map.addSource('datazones', {
+                    type: 'vector',
+                    tiles: [window.location.origin + zones.tiles],
+                    minzoom: zones.minzoom,
+                    maxzoom: zones.maxzoom
+                });
+            }
+            if (!map.getLayer('datazones')) {
+                map.addLayer({
+                    id: 'datazones',
+                    type: 'fill',
+                    source: 'datazones',
+                    'source-layer': zones.layer,
+                    paint: {'fill-opacity': 0.6}
+                });
+            }
+            // Viridis, most deprived (rank 1) darkest
+            map.setPaintProperty('datazones', 'fill-color', [
+                'interpolate', ['linear'],
+                ['at', ['get', 'i'], ['literal', zones.ranks]],
+                1, '#440154',
+                zones.ranks.length * 0.25, '#3b528b',
+                zones.ranks.length * 0.5, '#21918c',
+                zones.ranks.length * 0.75, '#5ec962',
+                zones.ranks.length, '#fde725'
+            ]);
+            map.setLayoutProperty('datazones', 'visibility', 'visible');
+            return '';
+        }
+    }
+});
@@ -0,0 +1,26 @@
+# gunicorn settings for simd_dashboard:server
+#
+#     gunicorn simd_dashboard:server
+#
+# The app is loaded once in the master and the workers are forked from it,
+# so the ranks table, share cube and compressed geometry are shared
+# copy-on-write instead of being rebuilt per worker. simd_rss.py reports the
+# memory each worker really adds.
+import gc
+import os
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+
+# SIMD_PRELOAD=0 loads the app in every worker, to compare memory use
+preload_app = os.environ.get('SIMD_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # builds the lazily loaded data once in the master, then moves it out of
+    # the garbage collector's reach, so collections in the workers don't
+    # write to (and copy) the shared pages
+    if preload_app:
+        import simd_dashboard
+        simd_dashboard.warm()
+        gc.freeze()
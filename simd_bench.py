@@ -0,0 +1,172 @@
+'''
+Benchmarks for the dashboard callback path.
+
+    python simd_bench.py [--url http://host:port] [--clients 8]
+                         [--requests 2000] [--output bench_results.json]
+
+Measures, and writes as JSON so runs can be compared:
+
+- startup: import time and peak RSS of simd_dashboard in a fresh process
+- callback: update_figures, and the encoded response cold (figure cache
+  cleared) and warm, for every dropdown combination
+- load: concurrent clients POSTing to /_dash-update-component, reporting
+  throughput, latency percentiles and bytes per response. Runs against
+  app.server on a local port unless --url points at a running server
+'''
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+STARTUP_SCRIPT = '''
+import json, resource, time, warnings
+warnings.filterwarnings('ignore')
+started = time.perf_counter()
+import simd_dashboard
+print(json.dumps(dict(
+    import_seconds=time.perf_counter() - started,
+    phases=simd_dashboard.startup_timings,
+    peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)))
+'''
+
+
+def percentiles(values):
+    values = sorted(values)
+
+    def at(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+    return dict(p50=at(50), p95=at(95), p99=at(99),
+                mean=statistics.mean(values), max=values[-1])
+
+
+def bench_startup(runs):
+    results = [json.loads(subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT], check=True,
+        capture_output=True, text=True).stdout) for _ in range(runs)]
+    return dict(import_seconds=percentiles(
+                    [r['import_seconds'] for r in results]),
+                peak_rss_kb=max(r['peak_rss_kb'] for r in results))
+
+
+def combinations(dashboard):
+    return list(itertools.product(
+        dashboard.deprv_features,
+        dashboard.simd_data.rank_columns(dashboard.ranks()),
+        dashboard.simd_data.share_labels))
+
+
+def bench_callback(dashboard):
+    figures, cold, warm = [], [], []
+    for deprv_label, domain_rank, share_label in combinations(dashboard):
+        key = (deprv_label, domain_rank, share_label, 0, 'councils', None,
+               None, 'exact')
+        started = time.perf_counter()
+        dashboard.update_figures(*key)
+        figures.append(time.perf_counter() - started)
+
+        dashboard.figure_cache().entries.pop(key, None)
+        started = time.perf_counter()
+        dashboard.figures_response(key)
+        cold.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        dashboard.figures_response(key)
+        warm.append(time.perf_counter() - started)
+    return dict(combinations=len(figures),
+                update_figures_seconds=percentiles(figures),
+                response_cold_seconds=percentiles(cold),
+                response_warm_seconds=percentiles(warm))
+
+
+def request_body(deprv_label, domain_rank, share_label):
+    values = [('deprv_label', 'value', deprv_label),
+              ('domain_rank', 'value', domain_rank),
+              ('share_label', 'value', share_label),
+              ('map_lod', 'data', 0),
+              ('map_mode', 'value', 'councils'),
+              ('rank_cutoff', 'value', 349),
+              ('compare_with', 'value', None),
+              ('uncertainty', 'value', 'exact')]
+    return json.dumps(dict(
+        output='..bar_share.figure...map.figure...figure_councils.data..',
+        outputs=[dict(id='bar_share', property='figure'),
+                 dict(id='map', property='figure'),
+                 dict(id='figure_councils', property='data')],
+        inputs=[dict(id=i, property=p, value=v) for i, p, v in values],
+        changedPropIds=['deprv_label.value'])).encode()
+
+
+def bench_load(url, bodies, clients, requests):
+    def post(body):
+        request = urllib.request.Request(
+            url + '/_dash-update-component', data=body,
+            headers={'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            size = len(response.read())
+        return time.perf_counter() - started, size
+
+    sample = [random.choice(bodies) for _ in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(post, sample))
+    elapsed = time.perf_counter() - started
+    return dict(clients=clients, requests=requests,
+                requests_per_second=requests / elapsed,
+                latency_seconds=percentiles([r[0] for r in results]),
+                bytes_per_response=statistics.mean(r[1] for r in results))
+
+
+def local_server(server):
+    # serves the Flask app on a free local port in a background thread
+    from werkzeug.serving import make_server
+    httpd = make_server('127.0.0.1', 0, server, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, 'http://127.0.0.1:{}'.format(httpd.server_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='benchmark a running server instead')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--startup-runs', type=int, default=3)
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    import warnings
+    warnings.filterwarnings('ignore')
+    import simd_dashboard as dashboard
+
+    results = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   python=platform.python_version(),
+                   startup=bench_startup(args.startup_runs),
+                   callback=bench_callback(dashboard))
+
+    bodies = [request_body(*key) for key in combinations(dashboard)]
+    if args.url:
+        results['load'] = bench_load(args.url.rstrip('/'), bodies,
+                                     args.clients, args.requests)
+    else:
+        httpd, url = local_server(dashboard.server)
+        try:
+            results['load'] = bench_load(url, bodies, args.clients,
+                                         args.requests)
+        finally:
+            httpd.shutdown()
+
+    with open(args.output, 'w') as myfile:
+        json.dump(results, myfile, indent=1)
+    print(json.dumps(results, indent=1))
+
+
+if __name__ == '__main__':
+    main()
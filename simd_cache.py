@@ -0,0 +1,119 @@
+'''
+Bounded LRU cache of encoded callback responses.
+
+Entries are the final JSON bytes sent to the browser, so a hit costs a dict
+lookup and a copy. The cache holds at most maxsize entries and maxbytes of
+them (a figure with inline geometry is close to a megabyte), the least
+recently used going first. With a directory the entries are also written to
+disk, where other gunicorn workers (or a restarted one) pick them up. The
+directory keeps at most disk_maxsize entries and disk_maxbytes, and entries
+of other versions are deleted when a cache is created.
+'''
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# disk writes between prunings of the directory
+PRUNE_EVERY = 32
+
+
+class FigureCache:
+
+    def __init__(self, maxsize=256, directory=None, version='',
+                 disk_maxsize=None, maxbytes=None, disk_maxbytes=None,
+                 sizeof=len):
+        # disk entries are named by version, and those written under another
+        # version are never read. sizeof gives an entry's size in bytes
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes or float('inf')
+        self.disk_maxsize = disk_maxsize or 4 * maxsize
+        self.disk_maxbytes = disk_maxbytes or 4 * self.maxbytes
+        self.sizeof = sizeof
+        self.size = 0
+        self.directory = directory
+        self.version = version
+        self.prefix = hashlib.sha1(version.encode()).hexdigest()[:12] + '-'
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.writes = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._prune()
+
+    def _path(self, key):
+        name = hashlib.sha1(repr((self.version, key)).encode()).hexdigest()
+        return os.path.join(self.directory, self.prefix + name + '.json')
+
+    def _prune(self):
+        # deletes the entries of other versions and, over disk_maxsize or
+        # disk_maxbytes, the least recently used. another worker may delete
+        # a file first
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if entry.name.startswith(self.prefix):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        files.sort()
+        size = sum(i[1] for i in files)
+        for count, (mtime, nbytes, path) in zip(range(len(files), 0, -1),
+                                                files):
+            if count <= self.disk_maxsize and size <= self.disk_maxbytes:
+                break
+            size -= nbytes
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+        if data is None and self.directory:
+            try:
+                with open(self._path(key), 'rb') as myfile:
+                    data = myfile.read()
+                os.utime(self._path(key))  # recently used, kept on pruning
+            except OSError:
+                pass
+            if data is not None:
+                self._remember(key, data)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def set(self, key, data):
+        self._remember(key, data)
+        if self.directory:
+            # written under a temporary name so readers never see half a file
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as myfile:
+                myfile.write(data)
+            os.replace(tmp, self._path(key))
+            self.writes += 1
+            if self.writes % PRUNE_EVERY == 0:
+                self._prune()
+
+    def _remember(self, key, data):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.sizeof(old)
+            self.entries[key] = data
+            self.size += self.sizeof(data)
+            # the newest entry is kept even when it alone is over maxbytes
+            while len(self.entries) > self.maxsize or \
+                    (self.size > self.maxbytes and len(self.entries) > 1):
+                self.size -= self.sizeof(self.entries.popitem(last=False)[1])
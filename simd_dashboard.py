@@ -1,12 +1,33 @@
-import pandas as pd
+import time
+STARTED = time.perf_counter() # for the startup report
 import plotly.graph_objects as go
 import dash
 #import dash_auth
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+import os
+import sys
 import json
-import base64
+import re
+import functools
+import hashlib
+import flask
+import plotly
+import numpy as np
+import pandas as pd
+import simd_cache
+import simd_data
+import simd_editions
+import simd_export
+import simd_geo
+import simd_ingest
+import simd_lod
+import simd_lookup
+import simd_metrics
+import simd_similar
+import simd_store
 '''
 VALID_USERNAME_PASSWORD_PAIRS = {
     'UBDC': 'Lilybank'
@@ -14,15 +35,214 @@ VALID_USERNAME_PASSWORD_PAIRS = {
 '''
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-with open('./GIS_data/Scotland_Councils_wgs84_1.json') as myfile:
-    councils =  json.load(myfile)
+# a new worker should be ready to serve within this many seconds, see
+# startup_report. SIMD_STARTUP_REPORT=1 prints the report at every start
+STARTUP_BUDGET = float(os.environ.get('SIMD_STARTUP_BUDGET', '1'))
+startup_timings = dict(imports=time.perf_counter() - STARTED)
+
+# 'url' serves the council geometry once as a cached, compressed file and the
+# map only references it; 'inline' embeds the whole GeoJSON in every figure
+GEOJSON_MODE = os.environ.get('SIMD_GEOJSON_MODE', 'url')
+
+# SIMD_CLIENTSIDE=1 sends the per-council counts to the browser once and
+# builds the figures there (assets/simd_clientside.js), so dropdown changes
+# never reach the server. It has no council selection and none of the
+# panels built from the dropdowns on the server
+CLIENTSIDE = os.environ.get('SIMD_CLIENTSIDE') == '1'
+
+# SIMD_BACKGROUND=1 runs the heavy callbacks, figure cache misses and the
+# selected council panels, as Dash background callbacks: separate processes
+# fed through a diskcache queue in SIMD_BACKGROUND_DIR, so a slow view never
+# holds a worker thread. Needs diskcache, multiprocess and psutil
+BACKGROUND = os.environ.get('SIMD_BACKGROUND') == '1'
+
+# SIMD_FIGURE_API=1 fetches the figures from the GET figure API instead of
+# Dash's POST callback, so the browser, a CDN or a caching proxy can answer
+# repeated views. Responses for the current version (?v=) are cached for a
+# year, unversioned ones for SIMD_FIGURE_MAX_AGE seconds
+FIGURE_API = os.environ.get('SIMD_FIGURE_API') == '1'
+FIGURE_MAX_AGE = int(os.environ.get('SIMD_FIGURE_MAX_AGE', '3600'))
+
+# how often, in seconds, the browser checks for newly ingested analyses
+ANALYSES_REFRESH = int(os.environ.get('SIMD_ANALYSES_REFRESH', '30'))
+
+# replicates of the rank uncertainty simulation behind the bar chart's error
+# bars (see simd_data.simulate_counts)
+REPLICATES = int(os.environ.get('SIMD_REPLICATES', '1000'))
+
+TILES_URL = '/tiles/datazones'
+EXPORT_URL = '/export'
+LOOKUP_URL = '/api/lookup'
+SIMILAR_URL = '/api/similar'
+FIGURE_URL = '/api/figure'
+LOGO_URL = '/images/logo.png'
+image_filename = './9722_UBDC_logo.png'
+
+DATASET = simd_data.DATASET
+GROUP_LABEL = DATASET['group_label'].capitalize()
+# the current edition, and the index's name without it for the change view
+EDITION = DATASET.get('year', DATASET['name'])
+INDEX_NAME = DATASET['name'].replace(EDITION, '').strip()
+
+# data assets are loaded on first use, so a worker starts serving straight
+# away. warm() builds all of them up front; gunicorn.conf.py calls it in the
+# preloading master so the workers share them
+
+@functools.lru_cache(maxsize=None)
+def ranks():
+    return simd_data.load_ranks()
+
+@functools.lru_cache(maxsize=None)
+def share_cube():
+    # local and national shares for every dropdown combination
+    return simd_data.build_share_cube(ranks())
+
+@functools.lru_cache(maxsize=None)
+def rank_bins():
+    # each council's cumulative rank counts per domain, for arbitrary rank
+    # cutoffs and the rank distributions
+    return simd_data.build_rank_bins(ranks())
+
+@functools.lru_cache(maxsize=256)
+def simulation(deprv_label, domain_rank, rank_cutoff):
+    # simulated counts of a deprivation level per replicate and council,
+    # built on first use for each level, domain and cutoff
+    if deprv_label == CUSTOM_DEPRV:
+        n, most_deprived = rank_cutoff, True
+    else:
+        n, most_deprived = simd_data.deprv_threshold(
+            deprv_label, simd_data.national_total(ranks()))
+    return simd_data.simulate_counts(ranks(), domain_rank, n, most_deprived,
+                                     REPLICATES)
 
-df = pd.read_csv('./Derived_Data/SIMD_2020_Ranks_and_Domain_Ranks.csv')
+@functools.lru_cache(maxsize=None)
+def domain_overlap():
+    # per council, how far every pair of domains agrees: the Jaccard overlap
+    # of their deprivation levels and their Spearman rank correlation
+    return simd_data.build_overlap(ranks(), rank_bins())
 
-# Launch the application
-app=dash.Dash(__name__, external_stylesheets=external_stylesheets)
-#auth = dash_auth.BasicAuth(app, VALID_USERNAME_PASSWORD_PAIRS)
-server = app.server # the Flask app
+@functools.lru_cache(maxsize=None)
+def editions():
+    # every SIMD edition in Derived_Data aligned on this edition's data zones
+    return simd_editions.load_editions(ranks(), EDITION)
+
+@functools.lru_cache(maxsize=None)
+def zone_ranks():
+    # the per-domain rank arrays the browser joins to the data zone tiles
+    return simd_data.zone_ranks(ranks())
+
+@functools.lru_cache(maxsize=None)
+def councils():
+    # the parsed GeoJSON is thousands of small objects that would stop
+    # gunicorn workers sharing memory, so it is only loaded when inlined.
+    # the schema's inline_geometry, the finest level of detail if missing
+    return simd_geo.load_councils(DATASET.get(
+        'inline_geometry',
+        DATASET['geometry'].format(len(simd_lod.LOD_LEVELS) - 1)))
+
+@functools.lru_cache(maxsize=None)
+def map_view():
+    # the schema's map_center and map_zoom, or the middle of the coarsest
+    # geometry zoomed to about its extent
+    if 'map_center' in DATASET:
+        return DATASET['map_center'], DATASET.get('map_zoom', 5)
+    with open(DATASET['geometry'].format(0)) as myfile:
+        points = np.array(re.findall(r'\[(-?[\d.]+),\s*(-?[\d.]+)\]',
+                                     myfile.read()), dtype=float)
+    west, south = points.min(axis=0)
+    east, north = points.max(axis=0)
+    return dict(lat=(south + north) / 2, lon=(west + east) / 2), \
+        float(np.log2(360 / max(east - west, 2 * (north - south), 1e-3)))
+
+@functools.lru_cache(maxsize=None)
+def councils_assets():
+    # in 'url' mode the map starts with the coarsest level of detail and
+    # swaps in finer geometry as the user zooms in (built by simd_lod.py)
+    assets = []
+    for level in range(len(simd_lod.LOD_LEVELS)):
+        with open(DATASET['geometry'].format(level), 'rb') as myfile:
+            assets.append(simd_geo.static_asset(myfile.read()))
+    return assets
+
+def councils_url(level):
+    return simd_geo.asset_url('/geometry/councils_lod{}.json'.format(level),
+                              councils_assets()[level])
+
+@functools.lru_cache(maxsize=None)
+def datazone_tiles():
+    # data zone vector tiles (built by simd_tiles.py); the data zone map is
+    # off without them
+    return simd_geo.tile_info(TILES_URL, simd_geo.TILES_FILE)
+
+@functools.lru_cache(maxsize=None)
+def council_index():
+    # point in polygon lookup over the finest council geometry
+    return simd_lookup.load_index(
+        DATASET['geometry'].format(len(simd_lod.LOD_LEVELS) - 1),
+        DATASET['geometry_key'])
+
+@functools.lru_cache(maxsize=None)
+def zone_index():
+    # and over the data zones, when their boundaries are in GIS_data
+    return simd_lookup.load_zone_index()
+
+def analyses():
+    # the per-council analyses written by simd_ingest.py, reloaded whenever
+    # it changes them
+    return simd_ingest.load_analyses()
+
+@functools.lru_cache(maxsize=None)
+def similar_index():
+    # nearest neighbours by domain rank profile, nationally and per council
+    return simd_similar.build_index(ranks())
+
+@functools.lru_cache(maxsize=None)
+def logo_asset():
+    # served as a cached file rather than inlined in the page as base64
+    with open(image_filename, 'rb') as myfile:
+        return simd_geo.static_asset(myfile.read(), mimetype='image/png')
+
+@functools.lru_cache(maxsize=None)
+def background_manager():
+    import diskcache
+    return dash.DiskcacheManager(diskcache.Cache(
+        os.environ.get('SIMD_BACKGROUND_DIR', './background')))
+
+@functools.lru_cache(maxsize=None)
+def figure_cache():
+    # encoded responses of update_figures keyed by its input values. Dash
+    # would rebuild and re-encode the figures on every request; the
+    # cached_figures hook answers repeated views with the cached bytes.
+    # SIMD_FIGURE_CACHE_DIR shares the entries between workers through the
+    # filesystem, keeping at most SIMD_FIGURE_CACHE_DISK_SIZE of them. The
+    # version covers the code, data and libraries the figures are built with
+    return simd_cache.FigureCache(
+        maxsize=int(os.environ.get('SIMD_FIGURE_CACHE_SIZE', '1024')),
+        maxbytes=int(os.environ.get('SIMD_FIGURE_CACHE_BYTES',
+                                    str(256 * 2 ** 20))),
+        directory=os.environ.get('SIMD_FIGURE_CACHE_DIR'),
+        disk_maxsize=int(os.environ.get('SIMD_FIGURE_CACHE_DISK_SIZE', '0')),
+        version=(''.join(simd_store.file_hash(path) for path in [
+                     __file__, simd_data.__file__, simd_editions.__file__,
+                     simd_lod.__file__, simd_data.DATA_FILE,
+                     simd_data.DATASET_FILE]) +
+                 repr([dash.__version__, plotly.__version__, pd.__version__,
+                       np.__version__]) +
+                 repr([councils_url(level) for level
+                       in range(len(simd_lod.LOD_LEVELS))])))
+
+@functools.lru_cache(maxsize=None)
+def figure_version():
+    # changes whenever any cached figure could
+    return hashlib.sha1(figure_cache().version.encode()).hexdigest()[:12]
+
+@functools.lru_cache(maxsize=None)
+def figure_assets():
+    # the figure API's bodies with their ETags and compressed copies, sized
+    # by their bodies
+    return simd_cache.FigureCache(maxsize=figure_cache().maxsize,
+                                  maxbytes=figure_cache().maxbytes,
+                                  sizeof=lambda asset: len(asset['body']))
 '''
 colors = {
     'background': '#111111',
@@ -30,161 +250,388 @@ colors = {
 }
 '''
 
-#returns a series with the total counts of datazones per council
-datazones_per_council = df.Council_area.value_counts()
-datazones_per_council.rename('Total_datazones', inplace=True)
-
 # deprivation options for dropdown boxes
-deprv_features = ['20% least deprived',
-                  '5% most deprived',
-                  '10% most deprived',
-                  '15% most deprived',
-                  '20% most deprived',
-                  '30% most deprived',
-                  '40% most deprived']
+deprv_features = simd_data.deprv_features
 deprv_options = [{'label': i, 'value': i} for i in deprv_features]
 
-# domain options for dropdown boxes
-domain_options = [{'label': i.replace('_', ' '), 'value': i}
-                  for i in df.columns[2:]]
+# 'custom threshold' takes the rank cutoff from the slider. the clientside
+# mode only has the counts of the fixed levels, so it has no custom option
+CUSTOM_DEPRV = 'custom threshold'
+if not CLIENTSIDE:
+    deprv_options.append({'label': CUSTOM_DEPRV, 'value': CUSTOM_DEPRV})
 
 # share options for dropdown boxes
 share_options = [{'label': 'local share', 'value': 'local_share'},
                  {'label': 'national share', 'value': 'national_share'}]
 
-image_filename = './9722_UBDC_logo.png'
-encoded_image = base64.b64encode(open(image_filename, 'rb').read())
-
-# Dash layout with several components: Div,Graph and Dropdown
-app.layout =html.Div([
-    html.Div([ #header div
-        html.Div([
-            html.H4(html.B('SIMD 2020 - LOCAL AND NATIONAL SHARE BY COUNCIL'),
-                    style=dict(lineHeight='7vh', textAlign='center',
-                               verticalAlign='middle', color='#a5b1cd'))
-        ], style=dict(backgroundColor='#2f3445', width='50%')),
-        html.Div([
-            html.Img(src='data:image/png;base64,{}'.format(encoded_image.decode()),
-                     style={'width':'100%', 'height':'100%',
-                            'object-fit': 'contain'})
-        ], style=dict(backgroundColor='#2f3445',  width='50%',
-                      height='80%', margin='10px 10px')),
-    ], style=dict(color='white', display='flex',
-                  backgroundColor='#2f3445',
-                  #borderBottom='thin lightgrey solid',
-                  height='10vh')),
-    html.Div([ # graphics div
-        html.Div( # left graphics div
-            style=dict(
-                width='50%',
-                backgroundColor='#282b38',
-                position='relative'),
-            children=[
-                html.Div(
-                    style={
-                        'width': '345px',
-                        'position': 'absolute',
-                        'top': '4vh', 'left': '20%',
-                        'color': '#a5b1bf',
-                        'background-color': '#282b38'
-                        },
-                    children=[
-                        html.P('Select deprivation level:'),
-                        dcc.Dropdown(
-                            id='deprv_label',
-                            options=deprv_options,
-                            value='5% most deprived'),
-                        html.Br(),
-                        html.P('Select domain rank:'),
-                        dcc.Dropdown(
-                            id='domain_rank',
-                            options=domain_options,
-                            value='SIMD2020_Rank'),
-                        html.Br(),
-                        html.P('Select share:'),
-                        dcc.Dropdown(
-                            id='share_label',
-                            options=share_options,
-                            value='local_share')]),
-                html.Div(
-                    id='my-div', #don't need this id
-                    style=dict(position='absolute',
-                               bottom='10px',
-                               left='0px',
-                               right='0px'), #another way to do a dictionary
-                    children=[ #by default 'children' is always present in each html component
-                        dcc.Graph(
-                            id='bar_share',
-                            figure=dict(data=[], layout={}))]
-                )
-            ]
-        ),
-        html.Div([
+# 'simulated' adds the spread of the shares under rank uncertainty to the bar
+# chart. the clientside mode only has the exact counts
+uncertainty_options = [{'label': 'exact shares', 'value': 'exact'},
+                       {'label': 'with rank uncertainty',
+                        'value': 'simulated'}]
+
+# bar chart title, filled with the deprivation level, domain rank and share
+BAR_TITLE = DATASET['name'] + ' - local and national share by ' + \
+            GROUP_LABEL + '\
+                     <br><sub><b>Deprivation level:</b> {}\
+                     <b>Domain rank:</b> {}\
+                     <b>Share:</b> {}</sub></br>'
+# the change view's title, filled with the two editions and as above
+CHANGE_TITLE = INDEX_NAME + ' {} to {} - change in local and national ' + \
+               'share by ' + GROUP_LABEL + '\
+                     <br><sub><b>Deprivation level:</b> {}\
+                     <b>Domain rank:</b> {}\
+                     <b>Share:</b> {}</sub></br>'
+
+# the selected council in the bar chart and map
+BAR_COLOUR = '#636efa'
+HIGHLIGHT_COLOUR = '#ef553b'
+
+# national rank bins of the distribution panels
+distribution_options = [{'label': 'deciles', 'value': 10},
+                        {'label': 'vigintiles', 'value': 20},
+                        {'label': 'percentiles', 'value': 100}]
+BIN_NAMES = {10: 'decile', 20: 'vigintile', 100: 'percentile'}
+
+# the similar data zones panel, and the most the similar zones API returns
+SIMILAR_K = 10
+SIMILAR_MAX = 100
+similar_options = [{'label': 'nationally', 'value': 'national'},
+                   {'label': 'within its ' + DATASET['group_label'],
+                    'value': 'council'}]
+
+# statistics of the domain overlap panels
+overlap_options = [{'label': 'Jaccard overlap', 'value': 'jaccard'},
+                   {'label': 'Spearman correlation', 'value': 'spearman'}]
+
+# download links for the current view, their hrefs set in the browser
+export_links = [dict(id='export_{}_{}'.format(rows, fmt), url=EXPORT_URL,
+                     rows=rows, format=fmt)
+                for rows in ['councils', 'datazones']
+                for fmt in simd_export.formats()]
+
+def serve_layout():
+    total_datazones = simd_data.national_total(ranks())
+    cutoff_marks = {round(total_datazones * i / 100): '{}%'.format(i)
+                    for i in [5, 10, 20, 30, 40, 50, 75, 100]}
+
+    # domain options for dropdown boxes
+    domain_options = [{'label': i.replace('_', ' '), 'value': i}
+                      for i in simd_data.rank_columns(ranks())]
+
+    # earlier or later editions to compare with. the clientside mode only has
+    # this edition's counts, so it has no change view
+    year = editions()['year']
+    compare_options = [{'label': '{} {} to {}'.format(INDEX_NAME,
+                                                      *sorted([i, year])),
+                        'value': i}
+                       for i in editions()['years'] if i != year]
+
+    # map level options for radio items
+    map_mode_options = [{'label': 'councils', 'value': 'councils'},
+                        {'label': 'data zones', 'value': 'datazones',
+                         'disabled': datazone_tiles() is None}]
+
+    # Dash layout with several components: Div,Graph and Dropdown
+    return html.Div([
+        html.Div([ #header div
             html.Div([
-                dcc.Graph(id='map', figure=dict(data=[], layout={}), style=dict(height='inherit'))
-            ], style=dict(height='89vh'))
-        ], style=dict(width='50%', float='right')) # outra forma de colocar a sintaxe
-    ], style={'backgroundColor': '#282b38', 'display': 'flex'})
-])
-# Create a Dash callback with three inputs and two outputs
-
-@app.callback([Output('bar_share', 'figure'),
-               Output('map', 'figure')],
-              [Input('deprv_label', 'value'),
-               Input('domain_rank', 'value'),
-               Input('share_label', 'value')])
-def update_figures(deprv_label, domain_rank, share_label):
-
-    # filters a subdataframe based on the chosen deprivation label
-    # rounded values. The official values are floored
-    if deprv_label == '20% least deprived':
-        deprv_by_domain = df.nlargest(round(6976 * 20 / 100), domain_rank)
-    else:
-        deprv_level = deprv_label[:deprv_label.find('%')]
-        deprv_level = int(deprv_level)
-        deprv_by_domain = df.nsmallest(round(6976 * deprv_level / 100),
-                                        domain_rank)
-
-    # returns a series with the domain/depr level's counts of dz per council
-    domain_dz_per_council = deprv_by_domain.Council_area.value_counts()
-    domain_dz_per_council.rename(deprv_label, inplace=True)
-
-    # dataset for the chosen domain/depr level with local and national shares
-    df_domain = pd.concat([datazones_per_council, domain_dz_per_council],
-                          axis=1)
-    df_domain.fillna(0, inplace=True)
-    df_domain = df_domain.astype('int64')
-
-    if share_label == 'local_share':
-        df_domain[share_label] = df_domain[deprv_label]* 100 / \
-                                 df_domain['Total_datazones']
-    else:
-        df_domain[share_label] = df_domain[deprv_label] * 100 / \
-                                  df_domain[deprv_label].sum()
+                html.H4(html.B('{} - LOCAL AND NATIONAL SHARE BY {}'.format(
+                            DATASET['name'], GROUP_LABEL).upper()),
+                        style=dict(lineHeight='7vh', textAlign='center',
+                                   verticalAlign='middle', color='#a5b1cd'))
+            ], style=dict(backgroundColor='#2f3445', width='50%')),
+            html.Div([
+                html.Img(src=simd_geo.asset_url(LOGO_URL, logo_asset()),
+                         style={'width':'100%', 'height':'100%',
+                                'object-fit': 'contain'})
+            ], style=dict(backgroundColor='#2f3445',  width='50%',
+                          height='80%', margin='10px 10px')),
+        ], style=dict(color='white', display='flex',
+                      backgroundColor='#2f3445',
+                      #borderBottom='thin lightgrey solid',
+                      height='10vh')),
+        html.Div([ # graphics div
+            html.Div( # left graphics div
+                style=dict(
+                    width='50%',
+                    backgroundColor='#282b38',
+                    position='relative'),
+                children=[
+                    html.Div(
+                        style={
+                            'width': '345px',
+                            'position': 'absolute',
+                            'top': '4vh', 'left': '20%',
+                            'color': '#a5b1bf',
+                            'background-color': '#282b38'
+                            },
+                        children=[
+                            html.P('Select deprivation level:'),
+                            dcc.Dropdown(
+                                id='deprv_label',
+                                options=deprv_options,
+                                value=simd_data.DEFAULT_LEVEL),
+                            html.Div([
+                                html.P('Custom threshold (most deprived ranks):'),
+                                dcc.Slider(
+                                    id='rank_cutoff',
+                                    min=1,
+                                    max=total_datazones,
+                                    step=1,
+                                    value=round(total_datazones * 5 / 100),
+                                    marks=cutoff_marks)
+                            ], style=dict(display='none') if CLIENTSIDE else {}),
+                            html.Br(),
+                            html.P('Select domain rank:'),
+                            dcc.Dropdown(
+                                id='domain_rank',
+                                options=domain_options,
+                                value=simd_data.rank_columns(ranks())[0]),
+                            html.Br(),
+                            html.P('Select share:'),
+                            dcc.Dropdown(
+                                id='share_label',
+                                options=share_options,
+                                value='local_share'),
+                            dcc.RadioItems(
+                                id='uncertainty',
+                                options=uncertainty_options,
+                                value='exact',
+                                labelStyle={'display': 'inline-block',
+                                            'margin-right': '15px'},
+                                style=dict(display='none') if CLIENTSIDE
+                                else {}),
+                            html.Div([
+                                html.Br(),
+                                html.P('Compare with edition:'),
+                                dcc.Dropdown(
+                                    id='compare_with',
+                                    options=compare_options,
+                                    placeholder='{} only'.format(
+                                        DATASET['name']),
+                                    disabled=not compare_options)
+                            ], style=dict(display='none') if CLIENTSIDE else {}),
+                            html.Br(),
+                            html.P('Select map level:'),
+                            dcc.RadioItems(
+                                id='map_mode',
+                                options=map_mode_options,
+                                value='councils',
+                                labelStyle={'display': 'inline-block',
+                                            'margin-right': '15px'}),
+                            html.P(id='figures_status'),
+                            html.P(['Download: '] + [
+                                html.A('{} {}'.format(i['rows'], i['format']),
+                                       id=i['id'], href=EXPORT_URL,
+                                       style={'margin-right': '10px'})
+                                for i in export_links])]),
+                    html.Div(
+                        id='my-div', #don't need this id
+                        style=dict(position='absolute',
+                                   bottom='10px',
+                                   left='0px',
+                                   right='0px'), #another way to do a dictionary
+                        children=[ #by default 'children' is always present in each html component
+                            dcc.Graph(
+                                id='bar_share',
+                                figure=dict(data=[], layout={}))]
+                    )
+                ]
+            ),
+            html.Div([
+                html.Div([
+                    dcc.Graph(id='map', figure=dict(data=[], layout={}), style=dict(height='inherit')),
+                    dcc.Store(id='map_lod', data=0),
+                    dcc.Store(id='zone_domain'),
+                    dcc.Store(id='zone_ranks'),
+                    dcc.Store(id='zones_painted'),
+                    dcc.Store(id='export_links', data=export_links),
+                    dcc.Store(id='figure_councils'),
+                    dcc.Store(id='selected_council'),
+                    dcc.Store(id='figure_api', data=dict(
+                        url=FIGURE_URL, version=figure_version(),
+                        custom=CUSTOM_DEPRV) if FIGURE_API else None),
+                    dcc.Store(id='share_table',
+                              data=share_table() if CLIENTSIDE else None)
+                ], style=dict(height='89vh'))
+            ], style=dict(width='50%', float='right')) # outra forma de colocar a sintaxe
+        ], style={'backgroundColor': '#282b38', 'display': 'flex'}),
+    # the selected council, rank distribution and domain overlap panels are
+    # built on the server, so the clientside mode leaves them out
+    ] + ([] if CLIENTSIDE else [
+        html.Div([ # selected council div
+            html.P(id='council_status', style=dict(
+                position='absolute', padding='0 20px', color='#a5b1bf')),
+            dcc.Graph(id='council_domains', figure=dict(data=[], layout={}),
+                      style=dict(width='50%')),
+            dcc.Graph(id='council_ranks', figure=dict(data=[], layout={}),
+                      style=dict(width='50%'))
+        ], style={'backgroundColor': '#282b38', 'display': 'flex'}),
+        html.Div([ # rank distribution div
+            dcc.RadioItems(
+                id='distribution_bins',
+                options=distribution_options,
+                value=10,
+                labelStyle={'display': 'inline-block',
+                            'margin-right': '15px'},
+                style=dict(padding='10px 20px')),
+            dcc.Graph(id='rank_distribution',
+                      figure=dict(data=[], layout={}),
+                      style=dict(height='80vh'))
+        ], style={'backgroundColor': '#282b38', 'color': '#a5b1bf'}),
+        html.Div([ # domain overlap div
+            dcc.RadioItems(
+                id='overlap_stat',
+                options=overlap_options,
+                value='jaccard',
+                labelStyle={'display': 'inline-block',
+                            'margin-right': '15px'},
+                style=dict(padding='10px 20px')),
+            html.Div([
+                dcc.Graph(id='overlap_matrix',
+                          figure=dict(data=[], layout={}),
+                          style=dict(width='40%', height='80vh')),
+                dcc.Graph(id='overlap_councils',
+                          figure=dict(data=[], layout={}),
+                          style=dict(width='60%', height='80vh'))
+            ], style=dict(display='flex'))
+        ], style={'backgroundColor': '#282b38', 'color': '#a5b1bf'}),
+    ]) + [
+        html.Div([ # similar data zones div
+            html.Div([
+                dcc.Input(id='similar_zone', type='text', debounce=True,
+                          placeholder='{}, e.g. {}'.format(
+                              DATASET['area_label'],
+                              ranks()[DATASET['area']].iloc[0])),
+                dcc.RadioItems(
+                    id='similar_scope',
+                    options=similar_options,
+                    value='national',
+                    labelStyle={'display': 'inline-block',
+                                'margin-right': '15px'},
+                    style=dict(display='inline-block', padding='0 20px'))
+            ], style=dict(padding='10px 20px')),
+            dcc.Graph(id='similar_profiles',
+                      figure=dict(data=[], layout={}),
+                      style=dict(height='60vh'))
+        ], style={'backgroundColor': '#282b38', 'color': '#a5b1bf'}),
+        html.Div([ # ingested analyses div
+            html.Div([
+                dcc.Dropdown(id='analysis', placeholder='Analysis',
+                             style=dict(width='400px')),
+                dcc.Dropdown(id='analysis_column', placeholder='Column',
+                             style=dict(width='250px', marginLeft='20px'))
+            ], style=dict(display='flex', padding='10px 20px',
+                          color='#282b38')),
+            dcc.Interval(id='analyses_refresh',
+                         interval=ANALYSES_REFRESH * 1000),
+            dcc.Graph(id='analysis_bar', figure=dict(data=[], layout={}))
+        ], style={'backgroundColor': '#282b38', 'color': '#a5b1bf'})
+    ])
+# the figures callback: eight inputs and three outputs, wired in create_app
+
+# figure_councils, the councils in bar order, lets highlight_council
+# restyle the figures without them being sent back to the server
+figure_outputs = [Output('bar_share', 'figure'),
+                  Output('map', 'figure'),
+                  Output('figure_councils', 'data')]
+figure_inputs = [Input('deprv_label', 'value'),
+                 Input('domain_rank', 'value'),
+                 Input('share_label', 'value'),
+                 Input('map_lod', 'data'),
+                 Input('map_mode', 'value'),
+                 Input('rank_cutoff', 'value'),
+                 Input('compare_with', 'value'),
+                 Input('uncertainty', 'value')]
 
-    df_domain = df_domain.round({share_label: 1})
-    df_domain.sort_values(by=share_label, ascending=False, inplace=True)
+def level_fraction(deprv_label, rank_cutoff):
+    # the deprivation level as a fraction of the datazones of any edition
+    if deprv_label == CUSTOM_DEPRV:
+        return rank_cutoff / simd_data.national_total(ranks()), True
+    return simd_data.deprv_fraction(deprv_label)
+
+def edition_change(deprv_label, domain_rank, share_label, compare_with,
+                   rank_cutoff):
+    # zones entering and leaving the level between compare_with and this
+    # edition, and the change in share in percentage points
+    fraction, most_deprived = level_fraction(deprv_label, rank_cutoff)
+    from_year, to_year = sorted([compare_with, editions()['year']])
+    df_change = simd_editions.movement(
+        editions(), simd_editions.domain_key(domain_rank, editions()['year']),
+        fraction, most_deprived, from_year, to_year)
+    return simd_editions.change_shares(df_change, from_year, to_year,
+                                       share_label), from_year, to_year
+
+def view_table(deprv_label, domain_rank, share_label, rank_cutoff=None,
+               compare_with=None):
+    # the per-council table behind the figures and its bar chart title
+    if compare_with:
+        df_domain, from_year, to_year = edition_change(
+            deprv_label, domain_rank, share_label, compare_with, rank_cutoff)
+    if deprv_label == CUSTOM_DEPRV:
+        # counts for any rank cutoff, from the cumulative rank counts
+        deprv_label = '{:.1f}% most deprived (ranks 1 to {})'.format(
+            rank_cutoff * 100 / simd_data.national_total(ranks()),
+            rank_cutoff)
+        if not compare_with:
+            df_domain = simd_data.threshold_shares(rank_bins(), domain_rank,
+                                                   rank_cutoff, share_label,
+                                                   deprv_label)
+    elif not compare_with:
+        # precomputed counts and shares for the chosen domain/depr level
+        df_domain = share_cube()[(deprv_label, domain_rank, share_label)]
+    if compare_with:
+        return df_domain, CHANGE_TITLE.format(from_year, to_year, deprv_label,
+                                              domain_rank, share_label)
+    return df_domain, BAR_TITLE.format(deprv_label, domain_rank, share_label)
+
+def update_figures(deprv_label, domain_rank, share_label, map_lod=0,
+                   map_mode='councils', rank_cutoff=None, compare_with=None,
+                   uncertainty='exact'):
+
+    started = time.perf_counter()
+    df_domain, title = view_table(deprv_label, domain_rank, share_label,
+                                  rank_cutoff, compare_with)
+    started = simd_metrics.lap('aggregate', started)
+    # the change view shows how many zones moved in and out of the level
+    text = None
+    if compare_with:
+        text = ['{} entering, {} leaving'.format(entering, leaving)
+                for entering, leaving in zip(df_domain.entering,
+                                             df_domain.leaving)]
+    # 95% of the simulated shares fall within the error bars
+    error_y = None
+    if uncertainty == 'simulated' and not compare_with:
+        councils_, counts = simulation(deprv_label, domain_rank,
+                                       rank_cutoff)
+        lower, upper = simd_data.share_intervals(
+            counts, rank_bins()['totals'], share_label)
+        lower = pd.Series(lower, index=councils_).reindex(df_domain.index)
+        upper = pd.Series(upper, index=councils_).reindex(df_domain.index)
+        error_y = dict(type='data', symmetric=False,
+                       array=(upper - df_domain[share_label]).clip(
+                           lower=0).round(1),
+                       arrayminus=(df_domain[share_label] - lower).clip(
+                           lower=0).round(1))
 #-------------------------------------------------------------------------------
 #######
-# This is a grouped bar chart showing two traces
-# (national and local shares) for each Council
+# A bar chart of the chosen share (or its change) for each Council, with
+# error bars when showing the rank uncertainty
 ######
     data = [go.Bar(
         x = df_domain.index,
         y = df_domain[share_label],
+        hovertext = text,
+        error_y = error_y,
         name = share_label.replace('_', ' ')
         #marker_color='rgb(26, 118, 255)'
     )]
 
     layout = go.Layout(
         #template = "plotly_dark", #with this template the title aligns to left..
-        title = dict(text='SIMD 2020 - local and national share by Council\
-                     <br><sub><b>Deprivation level:</b> {}\
-                     <b>Domain rank:</b> {}\
-                     <b>Share:</b> {}</sub></br>'\
-                     .format(deprv_label, domain_rank, share_label)
-                     ),
-        yaxis = dict(ticksuffix="%"),
+        title = dict(text=title),
+        yaxis = dict(ticksuffix=' pp' if compare_with else "%"),
         font=dict(color="#a5b1bf"),
         plot_bgcolor='#282b38',
         paper_bgcolor='#282b38'
@@ -192,12 +639,18 @@ def update_figures(deprv_label, domain_rank, share_label):
 
     data1 = [
         go.Choroplethmapbox(
-            geojson=councils,
+            geojson=councils_url(map_lod) if GEOJSON_MODE == 'url' \
+                    else councils(),
             locations=df_domain.index,
             z=df_domain[share_label],
-            featureidkey="properties.Name",
-            marker_opacity=0.6,
-            colorscale='Viridis'#'Blues'
+            hovertext=text,
+            featureidkey='properties.' + DATASET['geometry_key'],
+            # the data zone map draws its own layer under the council borders
+            marker_opacity=0.6 if map_mode == 'councils' else 0,
+            showscale=map_mode == 'councils',
+            # the change view diverges around no change
+            colorscale='RdBu_r' if compare_with else 'Viridis',#'Blues'
+            zmid=0 if compare_with else None
             )
         ]
 
@@ -205,13 +658,747 @@ def update_figures(deprv_label, domain_rank, share_label):
         #title='blabla',
         #xaxis='blabla',
         mapbox_style='open-street-map',#'carto-darkmatter',#'stamen-toner',#'carto-positron',
-        mapbox_zoom=5.6,
-        mapbox_center = {"lat": 57.834, "lon": -5.0},
+        mapbox_zoom=map_view()[1],
+        mapbox_center=map_view()[0],
         margin={"r":0,"t":0,"l":0,"b":0}, # sets the margins in px. default:80
+        uirevision='map', # keeps the user's zoom when the figure is replaced
         paper_bgcolor='#aad3df'#'#939090'#'#282b38'
         )
+    simd_metrics.lap('figure', started)
     return [{'data': data, 'layout': layout},
-            {'data': data1, 'layout': layout1}]
+            {'data': data1, 'layout': layout1},
+            list(df_domain.index)]
+
+def share_table():
+    # the counts table plus encoded default figures that the browser fills in
+    bar_template, map_template, _ = json.loads(json.dumps(
+        update_figures(simd_data.DEFAULT_LEVEL,
+                       simd_data.rank_columns(ranks())[0],
+                       'local_share'),
+        cls=plotly.utils.PlotlyJSONEncoder))
+    return dict(
+        simd_data.share_table(share_cube()),
+        bar=bar_template, map=map_template, title=BAR_TITLE,
+        geojson=[councils_url(level) for level
+                 in range(len(simd_lod.LOD_LEVELS))]
+                if GEOJSON_MODE == 'url' else None)
+
+# a click on a council's bar or area selects it, a second click clears it
+def select_council(map_click, bar_click, selected):
+    if dash.ctx.triggered_id == 'map':
+        council = map_click and map_click['points'][0]['location']
+    else:
+        council = bar_click and bar_click['points'][0]['x']
+    return None if council == selected else council
+
+# marks the selected council by patching the marker styles of the current
+# figures, so neither the figures nor the geometry are sent again
+def highlight_council(council, councils):
+    if councils is None:
+        raise PreventUpdate
+    bar = dash.Patch()
+    bar['data'][0]['marker'] = dict(color=[
+        HIGHLIGHT_COLOUR if i == council else BAR_COLOUR for i in councils])
+    map_ = dash.Patch()
+    map_['data'][0]['marker']['line'] = dict(
+        color=[HIGHLIGHT_COLOUR if i == council else 'white'
+               for i in councils],
+        width=[4 if i == council else 1 for i in councils])
+    return bar, map_
+
+# the selected council's share in every domain and its data zones' ranks
+def update_council_detail(council, deprv_label, domain_rank, share_label,
+                          rank_cutoff, bins=10, progress=None):
+    if council is None:
+        empty = dict(data=[], layout=dict(
+            title='Click a council for its domains and data zone ranks',
+            font=dict(color='#a5b1bf'), plot_bgcolor='#282b38',
+            paper_bgcolor='#282b38'))
+        return empty, empty
+    if deprv_label == CUSTOM_DEPRV and rank_cutoff is None:
+        raise PreventUpdate
+
+    domains = simd_data.rank_columns(ranks())
+    shares = []
+    for i, domain in enumerate(domains):
+        if progress is not None:
+            progress('{}: domain {} of {}'.format(council, i + 1,
+                                                  len(domains)))
+        shares.append(view_table(deprv_label, domain, share_label,
+                                 rank_cutoff)[0].loc[council, share_label])
+    layout = dict(font=dict(color='#a5b1bf'), plot_bgcolor='#282b38',
+                  paper_bgcolor='#282b38')
+    domains_figure = dict(
+        data=[go.Bar(x=[i.replace('_', ' ') for i in domains], y=shares,
+                     marker_color=[HIGHLIGHT_COLOUR if i == domain_rank
+                                   else BAR_COLOUR for i in domains])],
+        layout=dict(layout, yaxis=dict(ticksuffix='%'), title='{} - {} by '
+                    'domain'.format(council, share_label.replace('_', ' '))))
+
+    code = rank_bins()['councils'].index(council)
+    counts = simd_data.rank_histogram(rank_bins(), domain_rank,
+                                      distribution_edges(bins))[code]
+    ranks_figure = dict(
+        data=[go.Bar(x=list(range(1, bins + 1)), y=counts,
+                     marker_color=BAR_COLOUR)],
+        layout=dict(layout, bargap=0.05,
+                    xaxis=dict(title='national rank {} (1 most deprived)'
+                               .format(BIN_NAMES[bins])),
+                    yaxis=dict(title='data zones'),
+                    title='{} - data zone {}'.format(
+                        council, domain_rank.replace('_', ' '))))
+    return domains_figure, ranks_figure
+
+def distribution_edges(bins):
+    # the national rank bins' upper bounds, from 0
+    return np.rint(np.linspace(0, simd_data.national_total(ranks()),
+                               bins + 1)).astype(np.int64)
+
+# the share of every council's data zones in each national rank bin of the
+# chosen domain, read off the cumulative rank counts whatever the number of
+# data zones
+def update_rank_distribution(domain_rank, bins):
+    counts = simd_data.rank_histogram(rank_bins(), domain_rank,
+                                      distribution_edges(bins))
+    shares = counts * 100 / rank_bins()['totals'][:, None]
+    return dict(
+        data=[go.Heatmap(
+            x=list(range(1, bins + 1)), y=rank_bins()['councils'],
+            z=shares.round(1), colorscale='Viridis',
+            colorbar=dict(ticksuffix='%'),
+            hovertemplate='%{y}<br>' + BIN_NAMES[bins] +
+                          ' %{x}: %{z}% of data zones<extra></extra>')],
+        layout=dict(
+            title='{} - share of each {}\'s {}s by national {}'.format(
+                domain_rank.replace('_', ' '), DATASET['group_label'],
+                DATASET['area_label'], BIN_NAMES[bins]),
+            xaxis=dict(title='national rank {} (1 most deprived)'.format(
+                BIN_NAMES[bins])),
+            yaxis=dict(autorange='reversed'),
+            margin=dict(l=160), font=dict(color='#a5b1bf'),
+            plot_bgcolor='#282b38', paper_bgcolor='#282b38'))
+
+def overlap_values(deprv_label, rank_cutoff, stat):
+    # council (the last row all of them) x domain x domain
+    overlap = domain_overlap()
+    if stat == 'spearman':
+        return overlap['spearman']
+    if deprv_label == CUSTOM_DEPRV:
+        counts = simd_data.overlap_counts(
+            simd_data.cutoff_members(ranks(), rank_cutoff),
+            simd_data.council_codes(ranks(), overlap['councils']),
+            len(overlap['councils']))[:, 0]
+    else:
+        counts = overlap['counts'][:, overlap['levels'].index(deprv_label)]
+    return simd_data.jaccard(counts)
+
+# how far the domains agree in the selected council (or all of them), and
+# in every council for the chosen domain
+def update_overlap(council, deprv_label, domain_rank, rank_cutoff, stat):
+    if deprv_label == CUSTOM_DEPRV and rank_cutoff is None:
+        raise PreventUpdate
+    overlap = domain_overlap()
+    values = overlap_values(deprv_label, rank_cutoff, stat).round(2)
+    names = [i.replace('_', ' ') for i in overlap['domains']]
+    if stat == 'spearman':
+        name, scale = 'Spearman correlation of the ranks', dict(zmin=-1)
+    elif deprv_label == CUSTOM_DEPRV:
+        name, scale = 'Jaccard overlap of the {}s ranked 1 to {}'.format(
+            DATASET['area_label'], rank_cutoff), dict(zmin=0)
+    else:
+        name, scale = 'Jaccard overlap of the {} {}s'.format(
+            deprv_label, DATASET['area_label']), dict(zmin=0)
+    heatmap = dict(scale, zmax=1, colorscale='Viridis',
+                   texttemplate='%{z}')
+    layout = dict(font=dict(color='#a5b1bf'), plot_bgcolor='#282b38',
+                  paper_bgcolor='#282b38')
+
+    row = -1 if council is None else overlap['councils'].index(council)
+    matrix_figure = dict(
+        data=[go.Heatmap(x=names, y=names, z=values[row], **heatmap)],
+        layout=dict(layout, yaxis=dict(autorange='reversed'),
+                    margin=dict(l=160), title='{} - {}'.format(
+                        council or DATASET['name'], name)))
+
+    d = overlap['domains'].index(domain_rank)
+    councils_figure = dict(
+        data=[go.Heatmap(x=names, y=overlap['councils'], z=values[:-1, d],
+                         **heatmap)],
+        layout=dict(layout, yaxis=dict(autorange='reversed'),
+                    margin=dict(l=160), title='{} with {} by {}'.format(
+                        name, names[d], DATASET['group_label'])))
+    return matrix_figure, councils_figure
+
+# the domain rank profiles of a data zone and its most similar zones
+def update_similar(zone, scope):
+    layout = dict(font=dict(color='#a5b1bf'), plot_bgcolor='#282b38',
+                  paper_bgcolor='#282b38')
+    if not zone:
+        return dict(data=[], layout=dict(layout, title='Enter a {} for the '
+                    'ones with the most similar ranks'.format(
+                        DATASET['area_label'])))
+    result = similar_zones([zone.strip()], SIMILAR_K, scope)[0]
+    if result['similar'] is None:
+        return dict(data=[], layout=dict(layout, title='No {} {}'.format(
+            DATASET['area_label'], zone)))
+    index = similar_index()
+    names = [i.replace('_', ' ') for i in index['domains']]
+    traces = []
+    for similar in result['similar'] + [result]:
+        traces.append(go.Scatter(
+            x=names, y=ranks()[index['domains']].values[
+                index['rows'][similar['data_zone']]],
+            name='{} ({})'.format(similar['data_zone'], similar['council']),
+            mode='lines+markers',
+            line=dict(color=HIGHLIGHT_COLOUR if similar is result
+                      else BAR_COLOUR, width=3 if similar is result else 1)))
+    return dict(data=traces, layout=dict(
+        layout, yaxis=dict(title='national rank (1 most deprived)',
+                           autorange='reversed'),
+        title='{} ({}) - the {} {}s with the most similar ranks {}'.format(
+            result['data_zone'], result['council'], SIMILAR_K,
+            DATASET['area_label'],
+            'in ' + result['council'] if scope == 'council'
+            else 'nationally')))
+
+# lists the ingested analyses, checked on page load and every
+# ANALYSES_REFRESH seconds
+def update_analysis_options(n_intervals, options, analysis):
+    names = sorted(analyses())
+    new_options = [{'label': i.replace('_', ' '), 'value': i} for i in names]
+    if new_options == options:
+        raise PreventUpdate
+    return new_options, analysis if analysis in names else \
+        next(iter(names), None)
+
+def update_analysis_columns(analysis, column):
+    if analysis not in analyses():
+        return [], None
+    columns = analyses()[analysis]['columns']
+    return [{'label': i, 'value': i} for i in columns], \
+        column if column in columns else columns[0]
+
+# the chosen column of an ingested analysis by council
+def update_analysis(analysis, column):
+    layout = dict(font=dict(color='#a5b1bf'), plot_bgcolor='#282b38',
+                  paper_bgcolor='#282b38')
+    if analysis not in analyses() or \
+            column not in analyses()[analysis]['columns']:
+        return dict(data=[], layout=dict(layout, title='Add per-{} '
+                    'analyses with simd_ingest.py'.format(
+                        DATASET['group_label'])))
+    values = analyses()[analysis]['table'][column].astype(float).round(
+        2).sort_values(ascending=False)
+    return dict(
+        data=[go.Bar(x=values.index, y=values.values,
+                     marker_color=BAR_COLOUR)],
+        layout=dict(layout, title='{} - {} by {}'.format(
+            analysis.replace('_', ' '), column, DATASET['group_label'])))
+
+# switches the map geometry only when the zoom crosses a level boundary
+def update_map_lod(relayout_data, map_lod):
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        raise PreventUpdate
+    level = simd_lod.lod_for_zoom(relayout_data['mapbox.zoom'])
+    if level == map_lod:
+        raise PreventUpdate
+    return level
+
+# sends the chosen domain's data zone ranks for the data zone map. the
+# browser only asks (zone_domain) while the data zone map is shown
+def update_zone_ranks(domain_rank):
+    if datazone_tiles() is None:
+        return None
+    return dict(datazone_tiles(), ranks=zone_ranks()[domain_rank].tolist())
+
+def zone_export(deprv_label, domain_rank, rank_cutoff=None,
+                compare_with=None):
+    # the ranks table rows of the datazones in the level (in either edition
+    # when comparing), as chunks built while the download is sent
+    df = ranks()
+    ranks_ = df[domain_rank].values
+    if compare_with:
+        year = editions()['year']
+        domain = simd_editions.domain_key(domain_rank, year)
+        fraction, most_deprived = level_fraction(deprv_label, rank_cutoff)
+        years = sorted([compare_with, year])
+        before, after = [simd_editions.members(editions(), domain, fraction,
+                                               most_deprived, i)
+                         for i in years]
+        rows = np.flatnonzero(before | after)
+    elif deprv_label == CUSTOM_DEPRV:
+        rows = np.flatnonzero(ranks_ <= rank_cutoff)
+    else:
+        rows = simd_data.level_rows(
+            ranks_, *simd_data.deprv_threshold(deprv_label,
+                                               simd_data.national_total(df)))
+
+    def frames():
+        for start in range(0, len(rows), simd_export.CHUNKSIZE):
+            part = rows[start:start + simd_export.CHUNKSIZE]
+            if not compare_with:
+                yield df.iloc[part]
+                continue
+            columns = {i: np.asarray(df[i])[part]
+                       for i in [DATASET['area'], DATASET['group']]}
+            for i in years:
+                columns['{}_{}'.format(domain, i)] = \
+                    simd_editions.edition_ranks(editions(), domain, i)[part]
+            columns['movement'] = np.select(
+                [before[part] & after[part], after[part]],
+                ['staying', 'entering'], 'leaving')
+            yield pd.DataFrame(columns)
+    return frames()
+
+def export_view():
+    # the current view's table, or its datazones with rows=datazones, as a
+    # streamed CSV or Parquet download
+    args = flask.request.args
+    rows = args.get('rows', 'councils')
+    view = dict(deprv_label=args.get('deprv_label', simd_data.DEFAULT_LEVEL),
+                domain_rank=args.get('domain_rank',
+                                     simd_data.rank_columns(ranks())[0]),
+                rank_cutoff=args.get('rank_cutoff', type=int),
+                compare_with=args.get('compare_with') or None)
+    share_label = args.get('share_label', 'local_share')
+    if share_label not in simd_data.share_labels or \
+            rows not in ('councils', 'datazones'):
+        flask.abort(400)
+    try:
+        if rows == 'datazones':
+            frames = zone_export(**view)
+        else:
+            df_domain, _ = view_table(share_label=share_label, **view)
+            frames = simd_export.frame_chunks(
+                df_domain.rename_axis('Council').reset_index())
+    except (KeyError, ValueError, TypeError):
+        flask.abort(400)
+    name = '_'.join(str(i) for i in [rows, share_label] + list(view.values())
+                    if i is not None)
+    return simd_export.export_response(frames, re.sub(r'\W+', '_', name),
+                                       args.get('format', 'csv'))
+
+def lookup_points(lon, lat):
+    # council, data zone and the zone's ranks for each point
+    council = simd_lookup.locate(council_index(), lon, lat)
+    rows = np.full(len(lon), -1)
+    if zone_index() is not None:
+        zone = simd_lookup.locate(zone_index(), lon, lat)
+        zone_rows = pd.Index(ranks()[DATASET['area']]).get_indexer(
+            zone_index()['names'])
+        rows = np.where(zone >= 0, zone_rows[zone], -1)
+    found = rows >= 0
+    columns = simd_data.rank_columns(ranks())
+    values = {column: iter(ranks()[column].values[rows[found]].tolist())
+              for column in columns}
+    zones = iter(ranks()[DATASET['area']].values[rows[found]].tolist())
+
+    points = []
+    for i in range(len(lon)):
+        point = dict(lat=float(lat[i]), lon=float(lon[i]), council=None,
+                     data_zone=None, ranks=None)
+        if council[i] >= 0:
+            point['council'] = council_index()['names'][council[i]]
+        if found[i]:
+            point['data_zone'] = next(zones)
+            point['ranks'] = {column: next(values[column])
+                              for column in columns}
+        points.append(point)
+    return points
+
+def similar_zones(zones, k, within=None):
+    # the k zones with the nearest domain rank profiles to each zone,
+    # nationally or (within='council') in its own council
+    index = similar_index()
+    rows = np.array([index['rows'].get(zone, -1) for zone in zones])
+    results = [dict(data_zone=zone, council=None, similar=None)
+               for zone in zones]
+    found = np.flatnonzero(rows >= 0)
+    if not len(found):
+        return results
+    councils = index['councils'][rows[found]]
+    groups = sorted(set(councils)) if within == 'council' else [None]
+    for council in groups:
+        queries = found if council is None else found[councils == council]
+        neighbours, distances = simd_similar.nearest(index, rows[queries],
+                                                     k, council)
+        for i, row_neighbours, row_distances in zip(queries, neighbours,
+                                                    distances):
+            results[i]['council'] = index['councils'][rows[i]]
+            results[i]['similar'] = [
+                dict(data_zone=index['zones'][n],
+                     council=index['councils'][n],
+                     distance=round(float(d), 4))
+                for n, d in zip(row_neighbours, row_distances)]
+    return results
+
+def similar_view():
+    # ?zone=..&k=..&within=council, or a POSTed {"zones": [..], "k": ..,
+    # "within": "council"} for a batch
+    request = flask.request
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        zones, k, within = body.get('zones'), body.get('k', SIMILAR_K), \
+            body.get('within')
+    else:
+        zones = request.args.getlist('zone')
+        k = request.args.get('k', SIMILAR_K)
+        within = request.args.get('within')
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        flask.abort(400)
+    if not zones or not isinstance(zones, list) or \
+            not 1 <= k <= SIMILAR_MAX:
+        flask.abort(400)
+    return flask.jsonify(zones=similar_zones([str(i) for i in zones], k,
+                                             within))
+
+def lookup_view():
+    # ?lat=..&lon=.. for single points, or a POSTed {"lat": [..],
+    # "lon": [..]} for a batch, which is resolved in one vectorized pass
+    request = flask.request
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        lat, lon = body.get('lat'), body.get('lon')
+    else:
+        lat = request.args.getlist('lat')
+        lon = request.args.getlist('lon')
+    # every value must be a finite number, in two flat lists of one length
+    try:
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+    except (TypeError, ValueError):
+        flask.abort(400)
+    if lat.ndim != 1 or lon.ndim != 1 or not len(lat) or \
+            len(lat) != len(lon) or not np.isfinite(lat).all() or \
+            not np.isfinite(lon).all():
+        flask.abort(400)
+    return flask.jsonify(points=lookup_points(lon, lat))
+
+def figures_response(key):
+    started = time.perf_counter()
+    data = figure_cache().get(key)
+    hit = data is not None
+    if not hit:
+        bar, map_, councils_ = update_figures(*key)
+        # each output is encoded on its own to measure its payload
+        outputs = {}
+        serialize_started = time.perf_counter()
+        for output, figure in [('bar_share', bar), ('map', map_),
+                               ('figure_councils', councils_)]:
+            outputs[output] = json.dumps(
+                figure, cls=plotly.utils.PlotlyJSONEncoder).encode()
+            simd_metrics.observe('simd_payload_bytes', len(outputs[output]),
+                                 output=output)
+        simd_metrics.lap('serialize', serialize_started)
+        data = b'{"multi":true,"response":{"bar_share":{"figure":' + \
+               outputs['bar_share'] + b'},"map":{"figure":' + \
+               outputs['map'] + b'},"figure_councils":{"data":' + \
+               outputs['figure_councils'] + b'}}}'
+        figure_cache().set(key, data)
+    simd_metrics.observe('simd_callback_seconds',
+                         time.perf_counter() - started,
+                         cache='hit' if hit else 'miss')
+    return data
+
+FIGURES_OUTPUT = '..bar_share.figure...map.figure...figure_councils.data..'
+
+def figure_key(values):
+    # the figure cache key of input values by id, in update_figures'
+    # argument order
+    values = dict(values)
+    if values.get('deprv_label') != CUSTOM_DEPRV:
+        values['rank_cutoff'] = None # the slider only matters for custom levels
+    if values.get('compare_with') or not values.get('uncertainty'):
+        values['uncertainty'] = 'exact' # the change view has no error bars
+    return tuple(values.get(i.component_id) for i in figure_inputs)
+
+def cached_figures():
+    request = flask.request
+    if request.path != '/_dash-update-component' or request.method != 'POST':
+        return None
+    if 'cacheKey' in request.args:
+        return None # polling a background job, which Dash answers
+    body = request.get_json(silent=True)
+    if not body or body.get('output') != FIGURES_OUTPUT:
+        return None
+    key = figure_key({i.get('id'): i.get('value') for i in body['inputs']})
+    if BACKGROUND:
+        # misses are built by a background job rather than in this thread
+        data = figure_cache().get(key)
+        if data is None:
+            return None
+        return flask.Response(data, mimetype='application/json')
+    try:
+        data = figures_response(key)
+    except (KeyError, IndexError, TypeError):
+        return None # let Dash report invalid inputs
+    return flask.Response(data, mimetype='application/json')
+
+FIGURES_PREFIX = b'{"multi":true,"response":'
+
+def figure_asset(key):
+    # the cached response without Dash's wrapper, the same outputs by id:
+    # {"bar_share": {"figure": ..}, "map": .., "figure_councils": ..}
+    asset = figure_assets().get(key)
+    if asset is None:
+        asset = simd_geo.static_asset(
+            figures_response(key)[len(FIGURES_PREFIX):-1])
+        figure_assets().set(key, asset)
+    return asset
+
+def figure_view():
+    # GET ?deprv_label=..&domain_rank=..&share_label=.., optionally with
+    # map_lod, map_mode, rank_cutoff, compare_with, uncertainty and the
+    # version v
+    args = flask.request.args
+    values = {i.component_id: args.get(i.component_id)
+              for i in figure_inputs}
+    values['map_lod'] = args.get('map_lod', 0, type=int)
+    values['map_mode'] = args.get('map_mode', 'councils')
+    values['rank_cutoff'] = args.get('rank_cutoff', type=int)
+    # every distinct value would be a cache entry, so only the values the
+    # dashboard can send are answered
+    if values['uncertainty'] not in (None, 'exact', 'simulated') or \
+            values['map_mode'] not in ('councils', 'datazones') or \
+            not 0 <= values['map_lod'] < len(simd_lod.LOD_LEVELS):
+        flask.abort(400)
+    if values['deprv_label'] == CUSTOM_DEPRV and not (
+            values['rank_cutoff'] is not None and
+            1 <= values['rank_cutoff'] <= simd_data.national_total(ranks())):
+        flask.abort(400)
+    try:
+        asset = figure_asset(figure_key(values))
+    except (KeyError, IndexError, TypeError, ValueError):
+        flask.abort(400)
+    if args.get('v') == figure_version():
+        return simd_geo.asset_response(asset)
+    return simd_geo.asset_response(asset, FIGURE_MAX_AGE)
+
+# the background callbacks, which report their progress in a status line.
+# a job runs in its own process, so its figures reach other requests only
+# through a SIMD_FIGURE_CACHE_DIR disk cache
+def background_figures(set_progress, *values):
+    set_progress('Building the figures...')
+    key = figure_key(zip([i.component_id for i in figure_inputs], values))
+    response = json.loads(figures_response(key))['response']
+    return [response[i.component_id][i.component_property]
+            for i in figure_outputs]
+
+def background_council_detail(set_progress, *values):
+    return update_council_detail(*values, progress=set_progress)
+
+def warm():
+    # builds every lazily loaded asset and the first view of every dropdown
+    # combination, so no request pays for them
+    for asset in councils_assets():
+        simd_geo.compress_asset(asset)
+    if GEOJSON_MODE == 'inline':
+        councils()
+    rank_bins()
+    serve_layout()
+    domain_overlap()
+    similar_index()
+    zone_ranks()
+    council_index()
+    zone_index()
+    for deprv_label in ([] if CLIENTSIDE else deprv_features):
+        for domain_rank in simd_data.rank_columns(ranks()):
+            for share_label in simd_data.share_labels:
+                key = (deprv_label, domain_rank, share_label, 0,
+                       'councils', None, None, 'exact')
+                if FIGURE_API:
+                    simd_geo.compress_asset(figure_asset(key))
+                else:
+                    figures_response(key)
+    # the workers forked from here count their own requests only
+    simd_metrics.reset()
+    figure_cache().hits = figure_cache().misses = 0
+
+def create_app():
+    started = time.perf_counter()
+    # Launch the application
+    app=dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    #auth = dash_auth.BasicAuth(app, VALID_USERNAME_PASSWORD_PAIRS)
+    server = app.server # the Flask app
+
+    # /metrics, request timings and the opt-in profiler (SIMD_PROFILE=1)
+    simd_metrics.register(server)
+    simd_metrics.gauge('simd_figure_cache_hits', 'Figure cache hits',
+                       lambda: figure_cache().hits)
+    simd_metrics.gauge('simd_figure_cache_misses', 'Figure cache misses',
+                       lambda: figure_cache().misses)
+    simd_metrics.gauge('simd_figure_cache_entries', 'Figure cache entries',
+                       lambda: len(figure_cache().entries))
+
+    # static files, read and compressed on first request
+    for level in range(len(simd_lod.LOD_LEVELS)):
+        simd_geo.register_asset(
+            server, '/geometry/councils_lod{}.json'.format(level),
+            functools.partial(lambda level: councils_assets()[level], level))
+    simd_geo.register_asset(server, LOGO_URL, logo_asset)
+    simd_geo.register_tiles(server, TILES_URL, simd_geo.TILES_FILE)
+    server.add_url_rule(EXPORT_URL, 'export', export_view)
+    server.add_url_rule(FIGURE_URL, 'figure', figure_view)
+    server.add_url_rule(SIMILAR_URL, 'similar', similar_view,
+                        methods=['GET', 'POST'])
+    server.add_url_rule(LOOKUP_URL, 'lookup', lookup_view,
+                        methods=['GET', 'POST'])
+    server.before_request(cached_figures)
+    startup_timings['app'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # built on each page load rather than here, so creating the app reads no
+    # data. Dash would otherwise call it once now to check the callbacks'
+    # ids, which all exist in the layout
+    app.config.suppress_callback_exceptions = True
+    app.layout = serve_layout
+    startup_timings['layout'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if CLIENTSIDE:
+        app.clientside_callback(
+            ClientsideFunction(namespace='simd',
+                               function_name='update_figures'),
+            figure_outputs, figure_inputs, [State('share_table', 'data')])
+    elif FIGURE_API:
+        app.clientside_callback(
+            ClientsideFunction(namespace='simd',
+                               function_name='fetch_figures'),
+            figure_outputs, figure_inputs, [State('figure_api', 'data')])
+    elif BACKGROUND:
+        app.callback(figure_outputs, figure_inputs, background=True,
+                     manager=background_manager(), interval=250,
+                     progress=Output('figures_status', 'children'),
+                     progress_default='',
+                     running=[(Output('bar_share', 'style'),
+                               {'opacity': 0.5}, {'opacity': 1})])(
+                         background_figures)
+    else:
+        app.callback(figure_outputs, figure_inputs)(update_figures)
+
+    app.callback(Output('map_lod', 'data'),
+                 [Input('map', 'relayoutData')],
+                 [State('map_lod', 'data')])(update_map_lod)
+
+    if os.path.exists(simd_geo.TILES_FILE):
+        # the domain whose data zone ranks the map needs, set in the browser
+        # only while the data zone map is shown (assets/simd_clientside.js)
+        app.clientside_callback(
+            ClientsideFunction(namespace='simd', function_name='zone_domain'),
+            Output('zone_domain', 'data'),
+            [Input('domain_rank', 'value'),
+             Input('map_mode', 'value')],
+            [State('zone_domain', 'data')])
+
+        app.callback(Output('zone_ranks', 'data'),
+                     [Input('zone_domain', 'data')],
+                     prevent_initial_call=True)(update_zone_ranks)
+
+        # colours the data zone tiles in the browser
+        app.clientside_callback(
+            ClientsideFunction(namespace='simd',
+                               function_name='paint_datazones'),
+            Output('zones_painted', 'data'),
+            [Input('zone_ranks', 'data'),
+             Input('map', 'figure'),
+             Input('map_mode', 'value')])
+
+    # keeps the download links on the current view (assets/simd_clientside.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace='simd', function_name='export_links'),
+        [Output(i['id'], 'href') for i in export_links],
+        [Input('deprv_label', 'value'),
+         Input('domain_rank', 'value'),
+         Input('share_label', 'value'),
+         Input('rank_cutoff', 'value'),
+         Input('compare_with', 'value')],
+        [State('export_links', 'data')])
+
+    app.callback(Output('similar_profiles', 'figure'),
+                 [Input('similar_zone', 'value'),
+                  Input('similar_scope', 'value')])(update_similar)
+
+    app.callback([Output('analysis', 'options'),
+                  Output('analysis', 'value')],
+                 [Input('analyses_refresh', 'n_intervals')],
+                 [State('analysis', 'options'),
+                  State('analysis', 'value')])(update_analysis_options)
+
+    app.callback([Output('analysis_column', 'options'),
+                  Output('analysis_column', 'value')],
+                 [Input('analysis', 'value')],
+                 [State('analysis_column', 'value')])(update_analysis_columns)
+
+    app.callback(Output('analysis_bar', 'figure'),
+                 [Input('analysis', 'value'),
+                  Input('analysis_column', 'value')])(update_analysis)
+
+    if CLIENTSIDE:
+        startup_timings['callbacks'] = time.perf_counter() - started
+        return app
+
+    app.callback(Output('selected_council', 'data'),
+                 [Input('map', 'clickData'),
+                  Input('bar_share', 'clickData')],
+                 [State('selected_council', 'data')])(select_council)
+
+    # runs after update_figures, whose figure_councils output it waits for
+    app.callback([Output('bar_share', 'figure', allow_duplicate=True),
+                  Output('map', 'figure', allow_duplicate=True)],
+                 [Input('selected_council', 'data'),
+                  Input('figure_councils', 'data')],
+                 prevent_initial_call=True)(highlight_council)
+
+    council_detail = dict(
+        output=[Output('council_domains', 'figure'),
+                Output('council_ranks', 'figure')],
+        inputs=[Input('selected_council', 'data'),
+                Input('deprv_label', 'value'),
+                Input('domain_rank', 'value'),
+                Input('share_label', 'value'),
+                Input('rank_cutoff', 'value'),
+                Input('distribution_bins', 'value')])
+    if BACKGROUND:
+        app.callback(**council_detail, background=True,
+                     manager=background_manager(), interval=250,
+                     progress=Output('council_status', 'children'),
+                     progress_default='')(background_council_detail)
+    else:
+        app.callback(**council_detail)(update_council_detail)
+
+    app.callback(Output('rank_distribution', 'figure'),
+                 [Input('domain_rank', 'value'),
+                  Input('distribution_bins', 'value')])(
+                      update_rank_distribution)
+
+    app.callback([Output('overlap_matrix', 'figure'),
+                  Output('overlap_councils', 'figure')],
+                 [Input('selected_council', 'data'),
+                  Input('deprv_label', 'value'),
+                  Input('domain_rank', 'value'),
+                  Input('rank_cutoff', 'value'),
+                  Input('overlap_stat', 'value')])(update_overlap)
+    startup_timings['callbacks'] = time.perf_counter() - started
+    return app
+
+def startup_report():
+    # seconds spent in each startup phase against STARTUP_BUDGET
+    total = sum(startup_timings.values())
+    lines = ['{:<10} {:8.3f}s'.format(phase, seconds)
+             for phase, seconds in startup_timings.items()]
+    lines.append('{:<10} {:8.3f}s of a {:.3f}s budget{}'.format(
+        'total', total, STARTUP_BUDGET,
+        ' - OVER BUDGET' if total > STARTUP_BUDGET else ''))
+    return '\n'.join(lines)
+
+app = create_app()
+server = app.server
+
+if os.environ.get('SIMD_STARTUP_REPORT') == '1' or \
+        sum(startup_timings.values()) > STARTUP_BUDGET:
+    print(startup_report(), file=sys.stderr)
 
 #-------------------------------------------------------------------------------
 # server clause
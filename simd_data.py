@@ -0,0 +1,347 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import simd_store
+
+# the dataset schema: the ranks file, its area and grouping columns, the
+# rank columns and the deprivation levels. SIMD_DATASET points at another
+# schema to run the dashboard on another index or grouping
+DATASET_FILE = os.environ.get('SIMD_DATASET', './Derived_Data/SIMD_2020.json')
+
+
+def load_dataset(path=DATASET_FILE):
+    # ranks: the rank columns, every column but area and group if missing.
+    # most_deprived: 'lowest' when rank 1 is the most deprived, 'highest'
+    # when the largest rank is. total: the number of areas ranked
+    # nationally, the table's length if missing. The level marked default
+    # is shown first, the first level if none is
+    with open(path) as myfile:
+        dataset = json.load(myfile)
+    dataset.setdefault('ranks', None)
+    dataset.setdefault('most_deprived', 'lowest')
+    dataset.setdefault('total', None)
+    dataset.setdefault('area_label', dataset['area'])
+    dataset.setdefault('group_label', dataset['group'])
+    return dataset
+
+
+DATASET = load_dataset()
+DATA_FILE = DATASET['file']
+LEVELS = {level['label']: level for level in DATASET['levels']}
+
+# deprivation options for dropdown boxes
+deprv_features = list(LEVELS)
+DEFAULT_LEVEL = next((level['label'] for level in DATASET['levels']
+                      if level.get('default')), deprv_features[0])
+
+share_labels = ['local_share', 'national_share']
+
+
+def load_ranks(path=DATA_FILE, dataset=DATASET):
+    # memory-maps the binary store built by simd_store.py when it matches
+    # the CSV, otherwise parses the CSV. Ranks are returned with 1 the most
+    # deprived whatever the dataset's direction
+    store = simd_store.store_path(path)
+    if simd_store.is_fresh(path, store):
+        df = simd_store.read_store(store)
+    else:
+        df = pd.read_csv(path)
+    if dataset['most_deprived'] == 'highest':
+        df = df.copy()
+        for column in rank_columns(df, dataset):
+            df[column] = df[column].max() + 1 - df[column]
+    return df
+
+
+def rank_columns(df, dataset=DATASET):
+    if dataset['ranks'] is not None:
+        return list(dataset['ranks'])
+    return [column for column in df.columns
+            if column not in (dataset['area'], dataset['group'])]
+
+
+def national_total(df, dataset=DATASET):
+    return dataset['total'] or len(df)
+
+
+def deprv_fraction(deprv_label):
+    # returns the fraction of datazones in the chosen deprivation level and
+    # whether they are the lowest (most deprived) ranks
+    level = LEVELS[deprv_label]
+    return level['fraction'], level['most_deprived']
+
+
+def deprv_threshold(deprv_label, total):
+    # returns the number of datazones in the chosen deprivation level and
+    # whether they are the lowest (most deprived) ranks.
+    # rounded values. The official values are floored
+    fraction, most_deprived = deprv_fraction(deprv_label)
+    return round(total * fraction), most_deprived
+
+
+def add_share(df_domain, deprv_label, share_label):
+    # adds the local or national share column to a table of per-council
+    # totals and counts, rounded and sorted for the bar chart
+    if share_label == 'local_share':
+        df_domain[share_label] = df_domain[deprv_label] * 100 / \
+                                 df_domain['Total_datazones']
+    else:
+        df_domain[share_label] = df_domain[deprv_label] * 100 / \
+                                 df_domain[deprv_label].sum()
+
+    df_domain = df_domain.round({share_label: 1})
+    df_domain.sort_values(by=share_label, ascending=False, inplace=True)
+    return df_domain
+
+
+def build_share_cube(df):
+    # precomputes the df_domain table of update_figures for every
+    # deprivation level x domain rank x share, so a callback is a lookup.
+    # all domains are counted at once: a stable argsort of the rank matrix
+    # selects the same rows as nsmallest/nlargest(keep='first') per column
+    # and one bincount counts them per group and domain
+    names = np.asarray(df[DATASET['group']], dtype=object)
+    datazones_per_council = pd.Series(names).value_counts()
+    datazones_per_council.rename('Total_datazones', inplace=True)
+    councils = list(datazones_per_council.index)
+    codes = pd.Categorical(names, categories=councils).codes.astype(np.int64)
+
+    domains = rank_columns(df)
+    matrix = np.column_stack([df[column].values for column in domains])
+    ascending = np.argsort(matrix, axis=0, kind='stable')
+    descending = np.argsort(-matrix, axis=0, kind='stable')
+    offsets = np.arange(len(domains)) * len(councils)
+
+    cube = {}
+    for deprv_label in deprv_features:
+        n, most_deprived = deprv_threshold(deprv_label, national_total(df))
+        rows = (ascending if most_deprived else descending)[:n]
+        # counts of the level's datazones per domain and council
+        counts = np.bincount((codes[rows] + offsets).ravel(),
+                             minlength=len(domains) * len(councils)).reshape(
+                                 len(domains), len(councils))
+        for d, domain_rank in enumerate(domains):
+            # dataset for the chosen domain/depr level with local and national shares
+            df_domain = pd.DataFrame(
+                {'Total_datazones': datazones_per_council.values,
+                 deprv_label: counts[d]}, index=councils)
+            for share_label in share_labels:
+                cube[(deprv_label, domain_rank, share_label)] = \
+                    add_share(df_domain.copy(), deprv_label, share_label)
+    return cube
+
+
+def level_rows(ranks, n, most_deprived):
+    # row numbers, in table order, of the n datazones in a deprivation
+    # level; the rows build_share_cube counts
+    order = np.argsort(ranks if most_deprived else -ranks, kind='mergesort')
+    return np.sort(order[:n])
+
+
+def build_rank_bins(df):
+    # per council and domain, the number of datazones ranked at or below
+    # every rank: the cumulative counts of one-rank bins, bin k holding the
+    # ranks in (k-1, k] so tied .5 ranks fall in the right one. Any integer
+    # rank cutoff is then a lookup and any histogram a difference, at a cost
+    # independent of the number of datazones
+    names = np.asarray(df[DATASET['group']], dtype=object)
+    councils = sorted(set(names))
+    codes = pd.Categorical(names, categories=councils).codes.astype(np.int64)
+    domains = rank_columns(df)
+    # bins 0 to the largest rank
+    size = int(max(np.ceil(df[column].max()) for column in domains)) + 1
+    counts = np.zeros((len(councils), len(domains), size), dtype=np.int16)
+    for d, domain_rank in enumerate(domains):
+        bins = np.ceil(df[domain_rank].values).astype(np.int64)
+        counts[:, d] = np.bincount(codes * size + bins,
+                                   minlength=len(councils) * size).reshape(
+                                       len(councils), size)
+    return dict(councils=councils, domains=domains,
+                totals=np.bincount(codes, minlength=len(councils)),
+                cumulative=counts.cumsum(axis=2, dtype=np.int16))
+
+
+def threshold_counts(rank_bins, domain_rank, cutoff):
+    # number of datazones per council ranked at or below the cutoff
+    cumulative = rank_bins['cumulative']
+    cutoff = min(max(int(cutoff), 0), cumulative.shape[2] - 1)
+    return cumulative[:, rank_bins['domains'].index(domain_rank), cutoff]
+
+
+def rank_histogram(rank_bins, domain_rank, edges):
+    # per council, the number of datazones ranked in (edges[i], edges[i+1]].
+    # edges past the largest rank (a schema's total may be larger) count
+    # up to it
+    cumulative = rank_bins['cumulative']
+    d = rank_bins['domains'].index(domain_rank)
+    edges = np.clip(edges, 0, cumulative.shape[2] - 1)
+    return np.diff(cumulative[:, d, edges], axis=1)
+
+
+def threshold_shares(rank_bins, domain_rank, cutoff, share_label, label):
+    # the df_domain table of update_figures for an arbitrary rank cutoff
+    df_domain = pd.DataFrame(
+        {'Total_datazones': rank_bins['totals'],
+         label: threshold_counts(rank_bins, domain_rank, cutoff)},
+        index=rank_bins['councils'])
+    return add_share(df_domain, label, share_label)
+
+
+def council_codes(df, councils):
+    # each row's position in the sorted councils of build_rank_bins
+    names = np.asarray(df[DATASET['group']], dtype=object)
+    return pd.Categorical(names, categories=councils).codes.astype(np.int64)
+
+
+def group_sums(values, codes, size):
+    # per group, the sum of values (one row per datazone) over its rows, as
+    # one matrix product
+    onehot = np.zeros((size, len(codes)), dtype=values.dtype)
+    onehot[codes, np.arange(len(codes))] = 1
+    sums = onehot @ values.reshape(len(codes), -1)
+    return sums.reshape((size,) + values.shape[1:])
+
+
+def level_members(df, levels=deprv_features):
+    # the membership bitmap, datazone x domain x deprivation level: the rows
+    # build_share_cube counts for every level at once
+    domains = rank_columns(df)
+    matrix = np.column_stack([df[column].values for column in domains])
+    ascending = np.argsort(matrix, axis=0, kind='stable')
+    descending = np.argsort(-matrix, axis=0, kind='stable')
+    members = np.zeros(matrix.shape + (len(levels),), dtype=bool)
+    for l, deprv_label in enumerate(levels):
+        n, most_deprived = deprv_threshold(deprv_label, national_total(df))
+        rows = (ascending if most_deprived else descending)[:n]
+        members[rows, np.arange(len(domains)), l] = True
+    return members
+
+
+def cutoff_members(df, cutoff):
+    # the bitmap of the datazones ranked at or below a custom cutoff
+    matrix = np.column_stack([df[column].values
+                              for column in rank_columns(df)])
+    return (matrix <= cutoff)[:, :, None]
+
+
+def overlap_counts(members, codes, size):
+    # per council and level, the number of datazones in both domains of
+    # every pair (the diagonal counts each domain's). The last row is the
+    # whole dataset
+    both = (members[:, :, None, :] & members[:, None, :, :]).astype(
+        np.float32)
+    counts = group_sums(both, codes, size).astype(np.int32)
+    counts = np.concatenate([counts, counts.sum(axis=0, keepdims=True)])
+    # council x level x domain x domain
+    return counts.transpose(0, 3, 1, 2)
+
+
+def jaccard(counts):
+    # datazones in both domains of a pair over those in either, NaN when
+    # neither has any
+    sizes = np.diagonal(counts, axis1=-2, axis2=-1)
+    either = sizes[..., :, None] + sizes[..., None, :] - counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts / either
+
+
+def correlation(values, codes, size):
+    # per group, the Pearson correlation of every pair of columns
+    totals = np.bincount(codes, minlength=size)[:, None]
+    centred = values - (group_sums(values, codes, size) / totals)[codes]
+    covariance = group_sums(centred[:, :, None] * centred[:, None, :],
+                            codes, size)
+    scale = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return covariance / (scale[:, :, None] * scale[:, None, :])
+
+
+def build_overlap(df, rank_bins):
+    # how far the domains agree, per council and (the last row) for the
+    # whole dataset: the datazones in both domains of every pair for every
+    # deprivation level, and the Spearman correlation of every pair. That is
+    # the Pearson correlation of the ranks within the council, read off the
+    # cumulative rank counts with tied ranks (one bin) taking their average
+    councils, domains = rank_bins['councils'], rank_bins['domains']
+    codes = council_codes(df, councils)
+    cumulative = rank_bins['cumulative']
+    bins = np.column_stack([np.ceil(df[column].values).astype(np.int64)
+                            for column in domains])
+    columns = np.arange(len(domains))
+    below = cumulative[codes[:, None], columns, bins - 1]
+    within = cumulative[codes[:, None], columns, bins]
+    local = below + (within - below + 1) / 2
+    national = np.column_stack([df[column].values for column in domains])
+    spearman = np.concatenate([
+        correlation(local, codes, len(councils)),
+        correlation(national.astype(np.float64),
+                    np.zeros(len(df), dtype=np.int64), 1)])
+    return dict(councils=councils, domains=domains, levels=deprv_features,
+                counts=overlap_counts(level_members(df), codes,
+                                      len(councils)),
+                spearman=spearman)
+
+
+def simulate_counts(df, domain_rank, n, most_deprived, replicates=1000,
+                    noise=0.01, jitter=0.05, seed=0, batch=250):
+    # per replicate and council, the datazones in a deprivation level of n
+    # datazones when every rank gets normal noise (noise x the national
+    # total) and n is off by up to jitter x n, which also breaks tied ranks
+    # at random. Replicates are drawn a batch of rows at a time; a fixed
+    # seed gives every worker the same figures
+    councils = sorted(set(df[DATASET['group']]))
+    codes = council_codes(df, councils)
+    ranks = df[domain_rank].values.astype(np.float32)
+    if not most_deprived:
+        ranks = -ranks
+    total = national_total(df)
+    rng = np.random.default_rng(seed)
+    counts = np.empty((replicates, len(councils)), dtype=np.int64)
+    for start in range(0, replicates, batch):
+        size = min(batch, replicates - start)
+        noisy = ranks + rng.standard_normal((size, len(ranks)),
+                                            dtype=np.float32) * (noise * total)
+        levels = np.rint(n * (1 + rng.uniform(-jitter, jitter, size)))
+        levels = np.clip(levels.astype(np.int64), 1, len(ranks))
+        cutoffs = np.sort(noisy, axis=1)[np.arange(size), levels - 1]
+        rows, zones = np.nonzero(noisy <= cutoffs[:, None])
+        counts[start:start + size] = np.bincount(
+            rows * len(councils) + codes[zones],
+            minlength=size * len(councils)).reshape(size, len(councils))
+    return councils, counts
+
+
+def share_intervals(counts, totals, share_label, coverage=95):
+    # the lower and upper bounds of the central coverage% of the simulated
+    # local or national shares, per council
+    if share_label == 'local_share':
+        shares = counts * 100 / totals
+    else:
+        shares = counts * 100 / counts.sum(axis=1, keepdims=True)
+    tail = (100 - coverage) / 2
+    return np.percentile(shares, [tail, 100 - tail], axis=0).round(1)
+
+
+def zone_ranks(df):
+    # per domain, the ranks of every data zone in table order as int16,
+    # the compact array the data zone map joins to its vector tiles by row
+    return {domain_rank: np.rint(df[domain_rank].values).astype(np.int16)
+            for domain_rank in rank_columns(df)}
+
+
+def share_table(cube):
+    # per-council datazone totals and counts for every deprivation level and
+    # domain rank, the compact table the clientside mode computes shares from
+    councils = list(next(iter(cube.values())).index.sort_values())
+    table = dict(councils=councils, counts={})
+    for (deprv_label, domain_rank, share_label), df_domain in cube.items():
+        if share_label != 'local_share':
+            continue
+        df_domain = df_domain.reindex(councils)
+        table['totals'] = df_domain['Total_datazones'].tolist()
+        table['counts'].setdefault(deprv_label, {})[domain_rank] = \
+            df_domain[deprv_label].tolist()
+    return table
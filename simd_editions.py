@@ -0,0 +1,146 @@
+'''
+Several SIMD editions aligned on the data zones of the current one.
+
+An edition is a file matching the dataset's "editions" pattern, e.g.
+Derived_Data/SIMD_<year>_Ranks_and_Domain_Ranks.csv (or its binary store,
+see simd_store.py), with the area and group columns of the current one and
+rank columns named as its own but for the year: SIMD<year>_Rank and the
+SIMD<year>_<Domain>_Domain_Rank columns. When data zones changed between an
+edition and the current one, Derived_Data/Data_Zone_lookup_<year>.csv maps
+the edition's zones (Data_Zone_old) to the current ones (Data_Zone); zones
+merged by the lookup keep their most deprived rank. The lookup's file
+pattern and columns come from the dataset's "lookup".
+
+All ranks live in one float32 array (edition x domain x data zone, NaN where
+an edition has no rank), so the movement between any two editions is a sort,
+a few vectorized comparisons and a bincount per council.
+'''
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import simd_data
+import simd_store
+
+# a dataset without "editions" and "year" has a single edition
+EDITION_FILE = simd_data.DATASET.get('editions')
+# a dataset without "lookup" has the same areas in every edition
+LOOKUP = simd_data.DATASET.get('lookup')
+
+
+def edition_year(path):
+    name = os.path.splitext(os.path.basename(EDITION_FILE))[0]
+    pattern = re.escape(name).replace(re.escape('{}'), r'(\d{4})')
+    return re.match(pattern, os.path.basename(path)).group(1)
+
+
+def find_editions():
+    if EDITION_FILE is None:
+        return []
+    paths = glob.glob(EDITION_FILE.format('*')) + \
+        glob.glob(simd_store.store_path(EDITION_FILE.format('*')))
+    return sorted({edition_year(path) for path in paths})
+
+
+def domain_key(column, year):
+    # SIMD2020_Income_Domain_Rank -> SIMD_Income_Domain_Rank
+    return column.replace(year, '', 1)
+
+
+def load_edition(year, zones):
+    # the edition's ranks by domain key, reindexed on the given zones. its
+    # rank columns are every column but the dataset's area and group
+    dataset = dict(simd_data.DATASET, ranks=None)
+    other = simd_data.load_ranks(EDITION_FILE.format(year), dataset)
+    other_zones = np.asarray(other[dataset['area']], dtype=object)
+    if LOOKUP and os.path.exists(LOOKUP['file'].format(year)):
+        lookup = pd.read_csv(LOOKUP['file'].format(year))
+        lookup = dict(zip(lookup[LOOKUP['from']],
+                          lookup[LOOKUP.get('to', dataset['area'])]))
+        other_zones = np.array([lookup.get(z, z) for z in other_zones],
+                               dtype=object)
+    frame = pd.DataFrame({domain_key(column, year): other[column].values
+                          for column in simd_data.rank_columns(other,
+                                                               dataset)},
+                         index=other_zones)
+    frame = frame.groupby(level=0).min()
+    return frame.reindex(zones), len(other)
+
+
+def load_editions(df, year):
+    # df is the current edition, whose data zones and councils are used
+    years = sorted(set(find_editions()) | {year})
+    domains = [domain_key(column, year)
+               for column in simd_data.rank_columns(df)]
+    zones = np.asarray(df[simd_data.DATASET['area']], dtype=object)
+    names = np.asarray(df[simd_data.DATASET['group']], dtype=object)
+    councils = sorted(set(names))
+
+    ranks = np.full((len(years), len(domains), len(zones)), np.nan,
+                    dtype=np.float32)
+    totals = []
+    for e, other_year in enumerate(years):
+        if other_year == year:
+            for d, column in enumerate(simd_data.rank_columns(df)):
+                ranks[e, d] = df[column].values
+            totals.append(len(df))
+            continue
+        frame, total = load_edition(other_year, zones)
+        for d, domain in enumerate(domains):
+            if domain in frame:
+                ranks[e, d] = frame[domain].values
+        totals.append(total)
+
+    return dict(year=year, years=years, domains=domains, ranks=ranks,
+                totals=totals, councils=councils,
+                codes=pd.Categorical(names, categories=councils).codes)
+
+
+def edition_ranks(editions, domain, year):
+    return editions['ranks'][editions['years'].index(year),
+                             editions['domains'].index(domain)]
+
+
+def members(editions, domain, fraction, most_deprived, year):
+    # a mask of the data zones in the deprivation level in an edition: the
+    # first n by rank, ties in table order, as the share cube counts them
+    ranks = edition_ranks(editions, domain, year)
+    total = editions['totals'][editions['years'].index(year)]
+    ranked = np.flatnonzero(~np.isnan(ranks))  # no rank in this edition
+    mask = np.zeros(len(ranks), dtype=bool)
+    mask[ranked[simd_data.level_rows(ranks[ranked], round(total * fraction),
+                                     most_deprived)]] = True
+    return mask
+
+
+def movement(editions, domain, fraction, most_deprived, from_year, to_year):
+    # per council, the data zones in the deprivation level in each edition
+    # and those entering or leaving it between the two
+    before = members(editions, domain, fraction, most_deprived, from_year)
+    after = members(editions, domain, fraction, most_deprived, to_year)
+    codes = editions['codes']
+    size = len(editions['councils'])
+    return pd.DataFrame(
+        {'Total_datazones': np.bincount(codes, minlength=size),
+         from_year: np.bincount(codes, before, size).astype(int),
+         to_year: np.bincount(codes, after, size).astype(int),
+         'entering': np.bincount(codes, ~before & after, size).astype(int),
+         'leaving': np.bincount(codes, before & ~after, size).astype(int)},
+        index=editions['councils'])
+
+
+def change_shares(df_change, from_year, to_year, share_label):
+    # the change in local or national share, in percentage points
+    if share_label == 'local_share':
+        shares = df_change[[from_year, to_year]].div(
+            df_change['Total_datazones'], axis=0)
+    else:
+        shares = df_change[[from_year, to_year]] / \
+            df_change[[from_year, to_year]].sum()
+    df_change[share_label] = (shares[to_year] - shares[from_year]) * 100
+    df_change = df_change.round({share_label: 1})
+    df_change.sort_values(by=share_label, ascending=False, inplace=True)
+    return df_change
@@ -0,0 +1,83 @@
+'''
+Streamed CSV and Parquet downloads of dashboard tables.
+
+A table is given as an iterator of DataFrames with the same columns, so a
+long data zone or multi-year export is encoded a chunk at a time and never
+held whole in the Flask worker.
+'''
+import io
+
+import flask
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, CSV is always available
+    pyarrow = None
+
+# rows per CSV chunk or Parquet row group
+CHUNKSIZE = 2000
+
+MIMETYPES = {'csv': 'text/csv',
+             'parquet': 'application/vnd.apache.parquet'}
+
+
+def formats():
+    return ['csv', 'parquet'] if pyarrow is not None else ['csv']
+
+
+def frame_chunks(df, chunksize=CHUNKSIZE):
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def csv_chunks(frames):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+class ChunkSink(io.RawIOBase):
+    # a write-only file that hands out whatever was written since last asked
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(frames):
+    # one row group per frame, sent as soon as it is written
+    sink = ChunkSink()
+    writer = None
+    for frame in frames:
+        table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def export_response(frames, name, fmt='csv'):
+    # frames is consumed while the response is sent
+    if fmt not in formats():
+        flask.abort(400, 'unsupported export format: {}'.format(fmt))
+    chunks = csv_chunks(frames) if fmt == 'csv' else parquet_chunks(frames)
+    return flask.Response(
+        flask.stream_with_context(chunks), mimetype=MIMETYPES[fmt],
+        headers={'Content-Disposition':
+                 'attachment; filename="{}.{}"'.format(name, fmt)})
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+import flask
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# data zone vector tiles, built by simd_tiles.py
+TILES_FILE = './GIS_data/datazones.mbtiles'
+
+# the geometry never changes between deploys, so browsers may keep it a year
+MAX_AGE = 365 * 24 * 3600
+
+
+def load_councils(path):
+    with open(path) as myfile:
+        return json.load(myfile)
+
+
+def static_asset(data, mimetype='application/json'):
+    # serializes once and keeps a strong ETag; the compressed copies are made
+    # on first request (or up front by compress_asset)
+    if not isinstance(data, bytes):
+        data = json.dumps(data, separators=(',', ':')).encode()
+    return dict(body=data,
+                etag=hashlib.sha1(data).hexdigest(),
+                mimetype=mimetype)
+
+
+def compress_asset(asset):
+    # images are already compressed
+    if asset['mimetype'].startswith('image/') or 'gzip' in asset:
+        return asset
+    if brotli is not None:
+        asset['br'] = brotli.compress(asset['body'])
+    asset['gzip'] = gzip.compress(asset['body'], 9)
+    return asset
+
+
+def asset_url(url, asset):
+    # the url versioned by the asset's ETag, so a changed file is never read
+    # from a stale cache
+    return '{}?v={}'.format(url, asset['etag'][:12])
+
+
+def asset_response(asset, max_age=MAX_AGE):
+    request = flask.request
+    if asset['etag'] in request.if_none_match:
+        response = flask.Response(status=304)
+    else:
+        compress_asset(asset)
+        accepted = request.accept_encodings
+        if 'br' in asset and accepted['br']:
+            encoding = 'br'
+        elif 'gzip' in asset and accepted['gzip']:
+            encoding = 'gzip'
+        else:
+            encoding = None
+        response = flask.Response(asset[encoding or 'body'],
+                                  mimetype=asset['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(asset['etag'])
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(max_age)
+    return response
+
+
+def register_asset(server, url, load):
+    # serves the asset returned by load(), which is called on request so the
+    # asset can be built lazily
+    endpoint = 'asset_' + url.strip('/').replace('/', '_').replace('.', '_')
+    server.add_url_rule(url, endpoint, lambda: asset_response(load()))
+
+
+def tile_metadata(path):
+    # MBTiles metadata table as a dict, or None when the tiles are not built
+    if not os.path.exists(path):
+        return None
+    with closing(sqlite3.connect('file:{}?mode=ro'.format(path),
+                                 uri=True)) as db:
+        return dict(db.execute('SELECT name, value FROM metadata'))
+
+
+def tile_response(path, z, x, y):
+    # MBTiles stores rows in TMS order, flipped from the XYZ scheme. Without
+    # the tiles (they are not in the repo) every tile is not found
+    if not os.path.exists(path):
+        flask.abort(404)
+    with closing(sqlite3.connect('file:{}?mode=ro'.format(path),
+                                 uri=True)) as db:
+        row = db.execute('SELECT tile_data FROM tiles WHERE zoom_level=? '
+                         'AND tile_column=? AND tile_row=?',
+                         (z, x, (1 << z) - 1 - y)).fetchone()
+    if row is None:
+        response = flask.Response(status=204)
+    else:
+        data = bytes(row[0])
+        response = flask.Response(data,
+                                  mimetype='application/x-protobuf')
+        if data[:2] == b'\x1f\x8b':  # tippecanoe writes gzipped tiles
+            response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(MAX_AGE)
+    return response
+
+
+def tile_info(url, path):
+    # the tile url template and zoom range of an MBTiles file, or None when
+    # the file does not exist
+    metadata = tile_metadata(path)
+    if metadata is None:
+        return None
+    return dict(tiles=url + '/{z}/{x}/{y}.pbf',
+                minzoom=int(metadata.get('minzoom', 0)),
+                maxzoom=int(metadata.get('maxzoom', 14)),
+                layer=metadata.get('name', 'datazones'))
+
+
+def register_tiles(server, url, path):
+    # serves {z}/{x}/{y}.pbf from an MBTiles file
+    endpoint = 'tiles_' + url.strip('/').replace('/', '_')
+    server.add_url_rule(url + '/<int:z>/<int:x>/<int:y>.pbf', endpoint,
+                        lambda z, x, y: tile_response(path, z, x, y))
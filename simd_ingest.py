@@ -0,0 +1,275 @@
+'''
+Ingests hand-made per-council analyses (ODS sheets and CSV files) into the
+binary store, for the dashboard's analyses panel.
+
+    python simd_ingest.py [--watch] [--interval 2] [directory ...]
+
+Every .ods sheet and .csv file in the directories (Derived_Data and the
+repository root, e.g. deprv5_by_total.csv, by default) with one row per
+council becomes a store in Derived_Data/analyses. Title
+rows above the table and total rows below it are dropped: the table is the
+rows naming a council next to at least one number, its header the last text
+above each column. Council names must match the group geometry's
+properties (e.g. properties.Name of the council GeoJSON); a sheet with any
+other name is rejected with the names to fix. Reading ODS needs odfpy.
+
+The analyses are listed in Derived_Data/analyses/index.json, which is
+rewritten after every change. Running workers reload it when its
+modification time changes, so an analysis appears in the dashboard without
+a restart and no sheet is ever parsed by the app. --watch checks the
+directories every --interval seconds.
+'''
+import argparse
+import functools
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+
+import pandas as pd
+
+import simd_data
+import simd_store
+
+ANALYSES_DIR = './Derived_Data/analyses'
+INDEX_FILE = 'index.json'
+# names of total rows, which are dropped rather than rejected as unknown
+TOTAL_ROW = re.compile(r'(grand\s+)?total\b|scotland\b', re.IGNORECASE)
+
+
+def council_names(dataset=simd_data.DATASET):
+    # the names the map can draw, from the coarsest group geometry
+    with open(dataset['geometry'].format(0)) as myfile:
+        features = json.load(myfile)['features']
+    return {feature['properties'][dataset['geometry_key']]
+            for feature in features}
+
+
+def source_files(directories, dataset=simd_data.DATASET):
+    # the sheets to ingest, leaving out the dataset's own ranks files
+    ranks_files = {os.path.abspath(dataset['file'])}
+    if dataset.get('editions'):
+        ranks_files.update(os.path.abspath(path) for path in
+                           glob.glob(dataset['editions'].format('*')))
+    paths = set()
+    for directory in directories:
+        for pattern in ['*.ods', '*.csv']:
+            paths.update(source_path(path) for path in
+                         glob.glob(os.path.join(directory, pattern))
+                         if os.path.abspath(path) not in ranks_files)
+    return sorted(paths)
+
+
+def source_path(path):
+    # the same for a file however its directory was given: relative to the
+    # working directory within it, absolute elsewhere
+    path = os.path.abspath(path)
+    if path.startswith(os.path.join(os.getcwd(), '')):
+        return os.path.relpath(path)
+    return path
+
+
+def same_file(entry, path):
+    # an index entry's source may be written differently, e.g. with ./
+    return os.path.abspath(entry['source']) == os.path.abspath(path)
+
+
+def read_sheets(path):
+    # every sheet of the file as cells, without headers
+    if path.endswith('.ods'):
+        try:
+            return pd.read_excel(path, sheet_name=None, header=None,
+                                 engine='odf')
+        except ImportError:
+            raise ValueError('reading ODS needs odfpy')
+    return {None: pd.read_csv(path, header=None, dtype=object)}
+
+
+def table_name(path, sheet, sheets):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if sheet is not None and sheets > 1:
+        name += '_' + sheet
+    return re.sub(r'\W+', '_', name).strip('_')
+
+
+def tidy_sheet(cells, names, dataset=simd_data.DATASET):
+    # the per-council table in a sheet, indexed by council, and the names
+    # in it that are not councils
+    cells = cells.dropna(how='all').dropna(axis=1, how='all')
+    if cells.empty:
+        raise ValueError('empty sheet')
+    numbers = cells.apply(pd.to_numeric, errors='coerce')
+    text = cells.where(numbers.isna() & cells.notna())
+    # the council column has the most known names
+    known = text.apply(lambda column: column.isin(names).sum())
+    if known.max() == 0:
+        raise ValueError('no column of {} names'.format(
+            dataset['group_label']))
+    council = known.idxmax()
+    others = numbers.drop(columns=council)
+    rows = text[council].notna() & others.notna().any(axis=1) & \
+        ~text[council].astype(str).str.strip().str.match(TOTAL_ROW)
+    first = rows.values.argmax()
+
+    # each column's header is the last text above the first row
+    columns = {}
+    for column in others.columns[others[rows].notna().any()]:
+        above = text[column].iloc[:first].dropna()
+        header = ' '.join(str(above.iloc[-1]).split()) if len(above) else \
+            'column_{}'.format(column)
+        while header in columns.values():
+            header += '_'
+        columns[column] = header
+
+    table = others.loc[rows, list(columns)].rename(columns=columns)
+    table.index = pd.Index([str(i).strip() for i in text.loc[rows, council]],
+                           name=dataset['group'])
+    if table.index.duplicated().any():
+        raise ValueError('not one row per {}: {} rows for {}'.format(
+            dataset['group_label'], len(table), len(set(table.index))))
+    return table, sorted(set(table.index) - names)
+
+
+def ingest_file(path, names, output, dataset=simd_data.DATASET):
+    # writes a store per table in the file and returns their index entries.
+    # a store is named by the file's hash and never rewritten, as workers
+    # may have it mapped
+    version = simd_store.file_hash(path)[:12]
+    sheets = read_sheets(path)
+    tables = {}
+    for sheet, cells in sheets.items():
+        try:
+            table, unknown = tidy_sheet(cells, names, dataset)
+        except ValueError:
+            if sheet is None:
+                raise
+            continue  # other sheets of a workbook may be notes
+        if unknown:
+            raise ValueError('unknown {} names: {}'.format(
+                dataset['group_label'], ', '.join(unknown)))
+        tables[sheet] = table
+    if not tables:
+        raise ValueError('no sheet of one row per {}'.format(
+            dataset['group_label']))
+    entries = []
+    for sheet, table in tables.items():
+        name = table_name(path, sheet, len(sheets))
+        store = '{}.{}.store'.format(name, version)
+        simd_store.write_store(table.reset_index(),
+                               os.path.join(output, store), source=path)
+        entries.append(dict(name=name, source=path, sheet=sheet, store=store,
+                            columns=list(table.columns)))
+    return entries
+
+
+def ingest(directories, output=ANALYSES_DIR, failed=None,
+           dataset=simd_data.DATASET):
+    # converts new and changed files and rewrites the index when anything
+    # changed. failed keeps each rejected file's hash and problem, so it is
+    # not read again until it changes
+    failed = {} if failed is None else failed
+    names = council_names(dataset)
+    old = read_index(output)
+    entries = []
+    for path in source_files(directories, dataset):
+        fresh = [entry for entry in old if same_file(entry, path) and
+                 simd_store.is_fresh(path, os.path.join(output,
+                                                        entry['store']))]
+        if fresh:
+            entries += [dict(entry, source=path) for entry in fresh]
+            continue
+        version = simd_store.file_hash(path)
+        if failed.get(path, (None,))[0] == version:
+            continue
+        try:
+            entries += ingest_file(path, names, output, dataset)
+        except (ValueError, OSError, zipfile.BadZipFile) as error:
+            # a file being saved may be read half written; its last good
+            # tables stay until it is fixed
+            failed[path] = (version, str(error))
+            entries += [entry for entry in old if same_file(entry, path)]
+        else:
+            failed.pop(path, None)
+
+    if entries != old:
+        write_index(output, entries)
+        # stores of changed and removed files go once no longer listed
+        for store in {entry['store'] for entry in old} - \
+                {entry['store'] for entry in entries}:
+            shutil.rmtree(os.path.join(output, store), ignore_errors=True)
+    return entries
+
+
+def read_index(directory=ANALYSES_DIR):
+    try:
+        with open(os.path.join(directory, INDEX_FILE)) as myfile:
+            return json.load(myfile)
+    except OSError:
+        return []
+
+
+def write_index(directory, entries):
+    # written under a temporary name so workers never read half a file
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as myfile:
+        json.dump(entries, myfile, indent=1)
+    os.replace(tmp, os.path.join(directory, INDEX_FILE))
+
+
+@functools.lru_cache(maxsize=1)
+def load_analyses_at(directory, mtime):
+    # the analyses as memory-mapped tables indexed by council
+    analyses = {}
+    for entry in read_index(directory):
+        try:
+            table = simd_store.read_store(os.path.join(directory,
+                                                       entry['store']))
+        except OSError:
+            continue  # removed since the index was read
+        analyses[entry['name']] = dict(
+            entry, table=table.set_index(simd_data.DATASET['group']))
+    return analyses
+
+
+def load_analyses(directory=ANALYSES_DIR):
+    # reloaded whenever simd_ingest.py rewrites the index
+    try:
+        mtime = os.stat(os.path.join(directory, INDEX_FILE)).st_mtime_ns
+    except OSError:
+        return {}
+    return load_analyses_at(directory, mtime)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('directories', nargs='*',
+                        default=[os.path.dirname(simd_data.DATA_FILE), '.'])
+    parser.add_argument('--output', default=ANALYSES_DIR)
+    parser.add_argument('--watch', action='store_true')
+    parser.add_argument('--interval', type=float, default=2)
+    args = parser.parse_args()
+
+    failed, listed, reported = {}, None, {}
+    while True:
+        entries = ingest(args.directories, args.output, failed)
+        if entries != listed:
+            print('{} analyses in {}: {}'.format(
+                len(entries), args.output,
+                ', '.join(entry['name'] for entry in entries)))
+            listed = entries
+        for path, (version, problem) in failed.items():
+            if reported.get(path) != version:
+                print('skipped {}: {}'.format(path, problem))
+                reported[path] = version
+        if not args.watch:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+Builds the level-of-detail council geometries used by the dashboard map.
+
+The source is the quantized TopoJSON in Sco_councils_from_martinj.zip. Each
+shared arc is simplified once (Douglas-Peucker) so neighbouring councils keep
+matching borders, coordinates are rounded to the level's precision and the
+result is written as GeoJSON keyed by properties.Name, as plotly expects.
+
+    python simd_lod.py
+'''
+import json
+import zipfile
+
+import numpy as np
+
+SOURCE_ZIP = './GIS_data/Sco_councils_from_martinj.zip'
+SOURCE_TOPOJSON = 'Scotland_councils.json'
+NAMES_FILE = './GIS_data/Scotland_Councils_wgs84_1.json'
+LOD_FILE = './GIS_data/Scotland_Councils_lod{}.json'
+
+# the TopoJSON uses 2013 names and codes, the dashboard the SIMD 2020 ones
+NAME_ALIASES = {'Eilean Siar': 'Na h-Eileanan an Iar'}
+
+# (minimum map zoom, simplification tolerance in degrees, decimals kept).
+# the tolerance is about half a screen pixel at the top zoom of each level
+LOD_LEVELS = [(0, 0.01, 3),
+              (7, 0.002, 4),
+              (9, 0, 4)]
+
+
+def lod_for_zoom(zoom):
+    # index of the coarsest level that is still accurate at this zoom
+    level = 0
+    for i, (min_zoom, _, _) in enumerate(LOD_LEVELS):
+        if zoom >= min_zoom:
+            level = i
+    return level
+
+
+def decode_arcs(topology):
+    # delta-decoded and untransformed arcs, as float arrays of lon/lat
+    scale = np.array(topology['transform']['scale'])
+    translate = np.array(topology['transform']['translate'])
+    return [np.cumsum(np.array(arc, dtype=float), axis=0) * scale + translate
+            for arc in topology['arcs']]
+
+
+def simplify(points, tolerance):
+    # iterative Douglas-Peucker; always keeps both ends of the arc
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        segment = end - start
+        length = np.hypot(*segment)
+        if length == 0:  # closed arc, measure from the start point
+            dist = np.hypot(*(inner - start).T)
+        else:
+            offset = inner - start
+            dist = np.abs(segment[0] * offset[:, 1] -
+                          segment[1] * offset[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            stack += [(first, i), (i, last)]
+    return points[keep]
+
+
+def ring(arc_ids, arcs):
+    # stitches a ring from arcs; negative ids (~i) are reversed arcs
+    coords = []
+    for i in arc_ids:
+        arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+        coords.extend(arc[1:] if coords else arc)
+    return coords
+
+
+def polygon(rings, arcs):
+    # drops rings that collapsed below a triangle; a polygon without its
+    # outer ring disappears altogether (small islands at coarse levels)
+    rings = [ring(r, arcs) for r in rings]
+    if len(rings[0]) < 4:
+        return None
+    return [r for r in rings if len(r) >= 4]
+
+
+def build_level(topology, arcs, codes, tolerance, decimals):
+    arcs = [np.round(simplify(arc, tolerance), decimals).tolist()
+            for arc in arcs]
+    features = []
+    for geometry in topology['objects']['lad']['geometries']:
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['arcs']]
+        else:
+            polygons = geometry['arcs']
+        polygons = [p for p in (polygon(p, arcs) for p in polygons) if p]
+        name = geometry['properties']['LAD13NM']
+        name = NAME_ALIASES.get(name, name)
+        features.append(dict(
+            type='Feature',
+            properties=dict(Name=name, Census_Code=codes[name]),
+            geometry=dict(type='MultiPolygon', coordinates=polygons)))
+    return dict(type='FeatureCollection', features=features)
+
+
+def main():
+    with zipfile.ZipFile(SOURCE_ZIP) as myzip:
+        topology = json.loads(myzip.read(SOURCE_TOPOJSON))
+    arcs = decode_arcs(topology)
+
+    with open(NAMES_FILE) as myfile:
+        codes = {f['properties']['Name']: f['properties']['Census_Code']
+                 for f in json.load(myfile)['features']}
+
+    for level, (_, tolerance, decimals) in enumerate(LOD_LEVELS):
+        councils = build_level(topology, arcs, codes, tolerance, decimals)
+        with open(LOD_FILE.format(level), 'w') as myfile:
+            json.dump(councils, myfile, separators=(',', ':'))
+        print('level', level, sum(len(r) for f in councils['features']
+                                  for p in f['geometry']['coordinates']
+                                  for r in p), 'points')
+
+
+if __name__ == '__main__':
+    main()
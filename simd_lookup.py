@@ -0,0 +1,118 @@
+'''
+Point in polygon lookup of councils and data zones.
+
+The polygon edges are bucketed into horizontal strips, so a point is only
+tested against the edges in its own strip. A batch of points is resolved at
+once: every (point, edge) pair in the points' strips is checked for
+crossing a ray to the east, and a point is inside the polygon it crosses an
+odd number of times (which also handles holes and multipolygons).
+'''
+import json
+import os
+
+import numpy as np
+
+# data zone boundaries in WGS84, the GeoJSON simd_tiles.py is built from.
+# Not shipped with the repo; data zones are not looked up without it
+DATAZONES_FILE = './GIS_data/datazones.json'
+
+# points resolved per batch, which bounds the (point, edge) pairs in memory
+BATCH = 20000
+
+
+def polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def build_index(features, key, strips=4096):
+    # features are GeoJSON features, named by their properties[key]
+    names, edges, owners = [], [], []
+    for feature in features:
+        for polygon in polygons(feature['geometry']):
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                edges.append(np.hstack([ring[:-1], ring[1:]]))
+                owners.append(np.full(len(ring) - 1, len(names)))
+        names.append(feature['properties'][key])
+    edges = np.concatenate(edges)
+    owners = np.concatenate(owners)
+    # horizontal edges never cross an eastward ray
+    keep = edges[:, 1] != edges[:, 3]
+    edges, owners = edges[keep], owners[keep]
+
+    low = np.minimum(edges[:, 1], edges[:, 3])
+    high = np.maximum(edges[:, 1], edges[:, 3])
+    south, north = low.min(), high.max()
+    height = (north - south) / strips
+    first = np.clip(((low - south) / height).astype(np.int64), 0, strips - 1)
+    last = np.clip(((high - south) / height).astype(np.int64), 0, strips - 1)
+
+    # an edge is listed in every strip it spans
+    spans = last - first + 1
+    members = np.repeat(np.arange(len(edges)), spans)
+    strip = np.repeat(first, spans) + np.arange(len(members)) - \
+        np.repeat(np.cumsum(spans) - spans, spans)
+    order = np.argsort(strip, kind='mergesort')
+    members = members[order]
+    bounds = np.searchsorted(strip[order], np.arange(strips + 1))
+    return dict(names=names, edges=edges[members], owners=owners[members],
+                bounds=bounds, south=south, north=north, height=height,
+                strips=strips)
+
+
+def load_index(path, key):
+    with open(path) as myfile:
+        return build_index(json.load(myfile)['features'], key)
+
+
+def load_zone_index(path=DATAZONES_FILE, key='DataZone'):
+    if not os.path.exists(path):
+        return None
+    return load_index(path, key)
+
+
+def locate(index, lon, lat):
+    # the position in index['names'] of the polygon holding each point,
+    # -1 outside all of them
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    found = np.full(len(lon), -1, dtype=np.int64)
+    for start in range(0, len(lon), BATCH):
+        stop = start + BATCH
+        found[start:stop] = locate_batch(index, lon[start:stop],
+                                         lat[start:stop])
+    return found
+
+
+def locate_batch(index, lon, lat):
+    found = np.full(len(lon), -1, dtype=np.int64)
+    inside = (lat >= index['south']) & (lat <= index['north'])
+    points = np.flatnonzero(inside)
+    strip = np.minimum(((lat[points] - index['south']) /
+                        index['height']).astype(np.int64),
+                       index['strips'] - 1)
+    start, stop = index['bounds'][strip], index['bounds'][strip + 1]
+
+    # every (point, edge) pair in the point's strip
+    counts = stop - start
+    pair_points = np.repeat(points, counts)
+    pair_edges = np.repeat(start, counts) + np.arange(counts.sum()) - \
+        np.repeat(np.cumsum(counts) - counts, counts)
+
+    x1, y1, x2, y2 = index['edges'][pair_edges].T
+    px, py = lon[pair_points], lat[pair_points]
+    crosses = (y1 > py) != (y2 > py)
+    crosses[crosses] = px[crosses] < x1[crosses] + \
+        (py[crosses] - y1[crosses]) * (x2[crosses] - x1[crosses]) / \
+        (y2[crosses] - y1[crosses])
+
+    # odd crossings per (point, polygon) pair
+    size = len(index['names'])
+    pairs = pair_points[crosses] * size + index['owners'][pair_edges][crosses]
+    pairs, hits = np.unique(pairs, return_counts=True)
+    pairs = pairs[hits % 2 == 1]
+    # a point on a shared border may fall in both; the first one is kept
+    found[pairs[::-1] // size] = pairs[::-1] % size
+    return found
@@ -0,0 +1,147 @@
+'''
+Hot-path instrumentation for the dashboard: histograms of stage timings,
+callback latency and payload sizes, a Prometheus text /metrics route and an
+opt-in per-request profiler.
+
+Metrics are per process; under gunicorn each worker answers /metrics with its
+own numbers, so scrape every worker or sum them downstream.
+'''
+import cProfile
+import os
+import threading
+import time
+
+import flask
+
+# seconds and bytes
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+HELP = {
+    'simd_stage_seconds': 'Time spent in each stage of update_figures',
+    'simd_callback_seconds': 'Time to answer the figures callback',
+    'simd_payload_bytes': 'Encoded size of each callback output',
+    'simd_request_seconds': 'Time to answer a request, by route',
+    'simd_response_bytes': 'Size of the response body, by route',
+}
+BUCKETS = {
+    'simd_payload_bytes': SIZE_BUCKETS,
+    'simd_response_bytes': SIZE_BUCKETS,
+}
+
+# (name, sorted label items) -> [bucket counts..., sum, count]
+histograms = {}
+gauges = {}
+lock = threading.Lock()
+
+
+def observe(name, value, **labels):
+    buckets = BUCKETS.get(name, LATENCY_BUCKETS)
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        series = histograms.setdefault(key, [0] * (len(buckets) + 2))
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+def reset():
+    # drops every histogram, e.g. the samples of warming up a gunicorn master
+    # that its forked workers would otherwise report as their own
+    with lock:
+        histograms.clear()
+
+
+def lap(stage, started):
+    # records the time since started for a stage and returns the new start
+    now = time.perf_counter()
+    observe('simd_stage_seconds', now - started, stage=stage)
+    return now
+
+
+def gauge(name, help_text, function):
+    # a value read when /metrics is scraped
+    gauges[name] = (help_text, function)
+
+
+def label_text(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in items) + '}'
+
+
+def render():
+    lines = []
+    with lock:
+        items = sorted(histograms.items())
+    described = set()
+    for (name, labels), series in items:
+        if name not in described:
+            lines += ['# HELP {} {}'.format(name, HELP.get(name, name)),
+                      '# TYPE {} histogram'.format(name)]
+            described.add(name)
+        buckets = BUCKETS.get(name, LATENCY_BUCKETS)
+        for bound, count in zip(buckets, series):
+            lines.append('{}_bucket{} {}'.format(
+                name, label_text(labels, le=bound), count))
+        lines.append('{}_bucket{} {}'.format(
+            name, label_text(labels, le='+Inf'), series[-1]))
+        lines.append('{}_sum{} {}'.format(name, label_text(labels),
+                                          series[-2]))
+        lines.append('{}_count{} {}'.format(name, label_text(labels),
+                                            series[-1]))
+    for name, (help_text, function) in sorted(gauges.items()):
+        lines += ['# HELP {} {}'.format(name, help_text),
+                  '# TYPE {} gauge'.format(name),
+                  '{} {}'.format(name, function())]
+    return '\n'.join(lines) + '\n'
+
+
+def register(server):
+    # adds /metrics and request timing to the Flask server. Register before
+    # other before_request hooks so requests they answer are still timed.
+    # With SIMD_PROFILE=1 a request carrying an X-Profile header or a
+    # ?profile query parameter is run under cProfile and its stats written
+    # to SIMD_PROFILE_DIR (named in the X-Profile-File response header)
+    profile_enabled = os.environ.get('SIMD_PROFILE') == '1'
+    profile_dir = os.environ.get('SIMD_PROFILE_DIR', './profiles')
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(render(), mimetype='text/plain; version=0.0.4')
+
+    @server.before_request
+    def start_timer():
+        request = flask.request
+        flask.g.simd_started = time.perf_counter()
+        if profile_enabled and ('X-Profile' in request.headers or
+                                'profile' in request.args):
+            flask.g.simd_profile = cProfile.Profile()
+            flask.g.simd_profile.enable()
+
+    @server.after_request
+    def stop_timer(response):
+        profile = flask.g.pop('simd_profile', None)
+        if profile is not None:
+            profile.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, '{}-{}-{}.prof'.format(
+                flask.request.path.strip('/').replace('/', '_') or 'index',
+                os.getpid(), int(time.time() * 1000)))
+            profile.dump_stats(path)
+            response.headers['X-Profile-File'] = path
+        started = flask.g.pop('simd_started', None)
+        if started is not None:
+            route = flask.request.url_rule.rule \
+                if flask.request.url_rule else 'other'
+            observe('simd_request_seconds', time.perf_counter() - started,
+                    route=route)
+            if not response.is_streamed:
+                observe('simd_response_bytes',
+                        response.calculate_content_length() or 0,
+                        route=route)
+        return response
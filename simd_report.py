@@ -0,0 +1,115 @@
+'''
+Writes the dashboard's view for every deprivation level x domain x share as
+a standalone HTML map and a CSV table, for publication.
+
+    python simd_report.py [--output report] [--workers 8] [--lod 1]
+                          [--compare-with 2016] [--images]
+
+The tables and figures come from the dashboard's own view_table and
+update_figures. The combinations are spread over a process pool; each
+worker parses the council geometry once and inlines it in every map it
+writes. --images also writes a PNG of each map, which needs kaleido.
+'''
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.graph_objects as go
+import plotly.io
+import plotly.offline
+
+import simd_lod
+
+# set in each worker by init_worker
+dashboard = None
+geometry = None
+
+
+def init_worker(lod):
+    global dashboard, geometry
+    import warnings
+    warnings.filterwarnings('ignore')
+    import simd_dashboard
+    dashboard = simd_dashboard
+    with open(simd_dashboard.DATASET['geometry'].format(lod)) as myfile:
+        geometry = json.load(myfile)
+
+
+def report_name(*values):
+    name = '_'.join(str(i) for i in values if i)
+    return re.sub(r'\W+', '_', name).strip('_')
+
+
+def write_view(output, images, deprv_label, domain_rank, share_label,
+               compare_with=None):
+    name = report_name(deprv_label, domain_rank, share_label, compare_with)
+    df_domain, title = dashboard.view_table(deprv_label, domain_rank,
+                                            share_label,
+                                            compare_with=compare_with)
+    df_domain.rename_axis('Council').to_csv(
+        os.path.join(output, name + '.csv'))
+
+    _, map_, _ = dashboard.update_figures(deprv_label, domain_rank, share_label,
+                                       compare_with=compare_with)
+    figure = go.Figure(map_)
+    figure.update_layout(title=dict(text=title),
+                         margin={'r': 0, 't': 80, 'l': 0, 'b': 0})
+    # the geometry goes in after validation, which would copy it every time
+    figure = figure.to_dict()
+    figure['data'][0]['geojson'] = geometry
+    # the plotly.js bundle is written once by main
+    plotly.io.write_html(figure, os.path.join(output, name + '.html'),
+                         include_plotlyjs='directory', validate=False)
+    if images:
+        plotly.io.write_image(figure, os.path.join(output, name + '.png'),
+                              width=1000, height=1200, validate=False)
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', default='report')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--lod', type=int, default=1,
+                        choices=range(len(simd_lod.LOD_LEVELS)),
+                        help='council geometry level of detail')
+    parser.add_argument('--compare-with', help='report the change since '
+                        'another edition')
+    parser.add_argument('--images', action='store_true',
+                        help='also write PNG maps (needs kaleido)')
+    args = parser.parse_args()
+    if args.images:
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            parser.error('--images needs kaleido')
+
+    # the ranks and share cube are built here, before the workers are forked
+    init_worker(args.lod)
+    cube = dashboard.share_cube()
+    if args.compare_with and args.compare_with not in \
+            dashboard.editions()['years']:
+        parser.error('no {} edition found'.format(
+            args.compare_with))
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'plotly.min.js'), 'w') as myfile:
+        myfile.write(plotly.offline.get_plotlyjs())
+
+    views = [key + (args.compare_with,) for key in sorted(cube)]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.lod,)) as pool:
+        futures = [pool.submit(write_view, args.output, args.images, *view)
+                   for view in views]
+        for future in futures:
+            future.result()
+    print('{} views written to {} in {:.1f}s'.format(
+        len(views), args.output, time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Reports the memory of a running gunicorn master and its workers.
+
+Rss counts pages shared with the master in every worker; Pss splits shared
+pages between the processes using them and Private is what each worker
+really adds. Compare the output of
+
+    SIMD_PRELOAD=0 gunicorn simd_dashboard:server
+    gunicorn simd_dashboard:server
+
+after a few requests with
+
+    python simd_rss.py <master pid>
+
+Linux only, reads /proc/<pid>/smaps_rollup.
+'''
+import sys
+
+
+def memory(pid):
+    # Rss, Pss and private memory of a process in KB
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as myfile:
+        for line in myfile:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return dict(Rss=fields['Rss'], Pss=fields['Pss'],
+                Private=fields['Private_Clean'] + fields['Private_Dirty'])
+
+
+def children(pid):
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as myfile:
+        return [int(child) for child in myfile.read().split()]
+
+
+def main():
+    master = int(sys.argv[1])
+    workers = children(master)
+    print('{:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+        'pid', 'role', 'Rss KB', 'Pss KB', 'Private KB'))
+    total = 0
+    for pid in [master] + workers:
+        mem = memory(pid)
+        total += mem['Pss']
+        print('{:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+            pid, 'master' if pid == master else 'worker',
+            mem['Rss'], mem['Pss'], mem['Private']))
+    print('total Pss: {} KB for {} workers'.format(total, len(workers)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''
+Nearest neighbour search for data zones with similar domain rank profiles.
+
+A data zone's profile is its rank in every rank column, as a fraction of the
+national total, and similar zones are the nearest by Euclidean distance,
+nationally or within a council. With scipy installed each group has a
+KD-tree built at load time; without it a query scans the group's profiles,
+which is exact and still well under a millisecond at the size of SIMD.
+'''
+import numpy as np
+
+import simd_data
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional, the scan gives the same results
+    cKDTree = None
+
+# queries scanned per batch without scipy, which bounds the distance matrix
+BATCH = 1000
+
+
+def build_index(df, dataset=simd_data.DATASET):
+    # a group per council and one (None) for the whole dataset
+    domains = simd_data.rank_columns(df, dataset)
+    profiles = np.column_stack([df[column].values for column in domains]) / \
+        simd_data.national_total(df, dataset)
+    names = np.asarray(df[dataset['group']], dtype=object)
+    groups = {None: np.arange(len(df))}
+    for council in sorted(set(names)):
+        groups[council] = np.flatnonzero(names == council)
+    trees = {}
+    if cKDTree is not None:
+        trees = {council: cKDTree(profiles[rows])
+                 for council, rows in groups.items()}
+    zones = np.asarray(df[dataset['area']], dtype=object)
+    return dict(zones=zones, rows={z: i for i, z in enumerate(zones)},
+                councils=names, domains=domains, profiles=profiles,
+                groups=groups, trees=trees)
+
+
+def nearest(index, rows, k, council=None):
+    # the k nearest rows to each of the given rows in the group, itself
+    # left out, and their distances: two arrays of len(rows) x k
+    group = index['groups'][council]
+    k = min(k, len(group) - 1)
+    queries = index['profiles'][rows]
+    if index['trees']:
+        distances, found = index['trees'][council].query(queries, k + 1)
+        found = group[found.reshape(len(rows), k + 1)]
+        distances = distances.reshape(len(rows), k + 1)
+    else:
+        distances, found = scan(index['profiles'][group], queries, k + 1)
+        found = group[found]
+    # drop each row from its own results (or the farthest, for a row
+    # outside the group)
+    own = found == np.asarray(rows)[:, None]
+    own[~own.any(axis=1), -1] = True
+    keep = ~own
+    return (found[keep].reshape(len(rows), k),
+            distances[keep].reshape(len(rows), k))
+
+
+def scan(profiles, queries, k):
+    found = np.empty((len(queries), k), dtype=np.int64)
+    distances = np.empty((len(queries), k))
+    for start in range(0, len(queries), BATCH):
+        stop = start + BATCH
+        squared = ((queries[start:stop, None, :] -
+                    profiles[None, :, :]) ** 2).sum(axis=2)
+        nearest_ = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        part = np.take_along_axis(squared, nearest_, axis=1)
+        order = np.argsort(part, axis=1, kind='stable')
+        found[start:stop] = np.take_along_axis(nearest_, order, axis=1)
+        distances[start:stop] = np.sqrt(np.take_along_axis(part, order,
+                                                           axis=1))
+    return distances, found
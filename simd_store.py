@@ -0,0 +1,96 @@
+'''
+Binary columnar store for the ranks table.
+
+A store is a directory with one .npy file per column plus meta.json. Rank
+columns are int16 (float32 when a column holds tied fractional ranks, such
+as 4044.5 in the Income domain), text columns with few distinct values are
+categorical codes and the rest fixed-width strings. Loading memory-maps the
+arrays, so there is no text parsing at import time.
+
+    python simd_store.py [csv] [store]
+'''
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+META_FILE = 'meta.json'
+
+
+def store_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.store'
+
+
+def column_array(series):
+    # returns the compact array for a column and its meta.json entry
+    if series.dtype == object:
+        categories = sorted(series.unique())
+        if len(categories) <= len(series) // 2:
+            codes = pd.Categorical(series, categories=categories).codes
+            return codes.astype(np.int8 if len(categories) < 128
+                                else np.int16), \
+                dict(kind='category', categories=categories)
+        return series.values.astype(str), dict(kind='string')
+    values = series.values
+    if np.all(values == np.round(values)) and \
+            np.abs(values).max() <= np.iinfo(np.int16).max:
+        return values.astype(np.int16), dict(kind='number')
+    return values.astype(np.float32), dict(kind='number')
+
+
+def file_hash(path):
+    with open(path, 'rb') as myfile:
+        return hashlib.sha1(myfile.read()).hexdigest()
+
+
+def write_store(df, path, source=None):
+    os.makedirs(path, exist_ok=True)
+    meta = dict(source=source and file_hash(source), columns=[])
+    for i, column in enumerate(df.columns):
+        values, info = column_array(df[column])
+        info.update(name=column, file='{}.npy'.format(i))
+        np.save(os.path.join(path, info['file']), values)
+        meta['columns'].append(info)
+    with open(os.path.join(path, META_FILE), 'w') as myfile:
+        json.dump(meta, myfile, indent=1)
+
+
+def read_store(path):
+    with open(os.path.join(path, META_FILE)) as myfile:
+        meta = json.load(myfile)
+    columns = {}
+    for info in meta['columns']:
+        values = np.load(os.path.join(path, info['file']), mmap_mode='r')
+        if info['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, info['categories'])
+        elif info['kind'] == 'string':
+            values = values.astype(object)
+        columns[info['name']] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def is_fresh(csv_path, path):
+    # a store built from a different CSV is ignored until it is rebuilt.
+    # hashing is used rather than mtimes, which a git checkout does not keep
+    meta = os.path.join(path, META_FILE)
+    if not os.path.exists(meta):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    with open(meta) as myfile:
+        return json.load(myfile)['source'] == file_hash(csv_path)
+
+
+def main():
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else \
+        './Derived_Data/SIMD_2020_Ranks_and_Domain_Ranks.csv'
+    path = sys.argv[2] if len(sys.argv) > 2 else store_path(csv_path)
+    write_store(pd.read_csv(csv_path), path, source=csv_path)
+    print('wrote', path)
+
+
+if __name__ == '__main__':
+    main()
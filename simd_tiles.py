@@ -0,0 +1,71 @@
+'''
+Builds the data zone vector tiles used by the dashboard's data zone map.
+
+The boundaries are not shipped with the repo. Download the 2011 data zone
+boundaries (SG_DataZone_Bdry_2011) from spatialdata.gov.scot, convert them to
+WGS84 GeoJSON, e.g.
+
+    ogr2ogr -t_srs EPSG:4326 datazones.json SG_DataZone_Bdry_2011.shp
+
+and run
+
+    python simd_tiles.py datazones.json
+
+The tiles only carry the zone id and its row number in the ranks table; the
+ranks themselves are joined in the browser, so the tiles never need
+rebuilding when the ranks change. Needs tippecanoe on the PATH.
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+import simd_data
+import simd_geo
+
+LAYER = 'datazones'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('boundaries', help='data zone GeoJSON in WGS84')
+    parser.add_argument('--id-field', default='DataZone',
+                        help='property holding the data zone code')
+    parser.add_argument('--output', default=simd_geo.TILES_FILE)
+    parser.add_argument('--min-zoom', type=int, default=5)
+    parser.add_argument('--max-zoom', type=int, default=12)
+    args = parser.parse_args()
+
+    if shutil.which('tippecanoe') is None:
+        parser.error('tippecanoe is not installed')
+
+    df = simd_data.load_ranks()
+    rows = {zone: i for i, zone in enumerate(df[simd_data.DATASET['area']])}
+
+    with open(args.boundaries) as myfile:
+        zones = json.load(myfile)
+    features = []
+    for feature in zones['features']:
+        zone = feature['properties'][args.id_field]
+        if zone in rows:
+            feature['properties'] = dict(Data_Zone=zone, i=rows[zone])
+            features.append(feature)
+    print(len(features), 'of', len(rows), 'data zones have boundaries')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'datazones.json')
+        with open(path, 'w') as myfile:
+            json.dump(dict(type='FeatureCollection', features=features),
+                      myfile)
+        subprocess.run(['tippecanoe', '--force', '-o', args.output,
+                        '-n', LAYER, '-l', LAYER,
+                        '-Z', str(args.min_zoom), '-z', str(args.max_zoom),
+                        '--detect-shared-borders',
+                        '--drop-smallest-as-needed', path],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
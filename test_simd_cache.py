@@ -0,0 +1,55 @@
+'''
+Behaviour of the figure cache: LRU eviction by count and bytes, and the
+pruning of its disk directory.
+
+    python -m pytest -q
+'''
+import os
+
+import simd_cache
+
+
+def test_least_recently_used_goes_first():
+    cache = simd_cache.FigureCache(maxsize=2)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'  # now b is the least recently used
+    cache.set('c', b'3')
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_bounded_by_bytes():
+    cache = simd_cache.FigureCache(maxsize=10, maxbytes=10)
+    for key in 'abc':
+        cache.set(key, b'x' * 4)
+    assert list(cache.entries) == ['b', 'c']
+    assert cache.size == 8
+    cache.set('b', b'x' * 2)  # replacing an entry replaces its size
+    assert cache.size == 6
+    cache.set('d', b'x' * 20)  # the newest entry is kept on its own
+    assert list(cache.entries) == ['d']
+    assert cache.size == 20
+
+
+def test_disk_entries_shared_and_pruned(tmp_path):
+    cache = simd_cache.FigureCache(maxsize=1, directory=str(tmp_path),
+                                   version='1', disk_maxsize=3)
+    for i in range(simd_cache.PRUNE_EVERY):
+        cache.set(i, b'figure')
+        os.utime(cache._path(i), (i, i))  # written in key order
+    # pruned down to the three most recent
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(cache._path(i))
+        for i in range(simd_cache.PRUNE_EVERY - 3, simd_cache.PRUNE_EVERY))
+
+    # another worker of the same version reads them from disk
+    other = simd_cache.FigureCache(maxsize=1, directory=str(tmp_path),
+                                   version='1', disk_maxsize=3)
+    assert other.get(simd_cache.PRUNE_EVERY - 1) == b'figure'
+    assert other.get(0) is None
+
+    # a new version deletes them
+    simd_cache.FigureCache(directory=str(tmp_path), version='2')
+    assert os.listdir(tmp_path) == []
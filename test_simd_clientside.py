@@ -0,0 +1,35 @@
+'''
+Pins the shares the clientside mode computes in the browser
+(assets/simd_clientside.js) to the server's.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import simd_data
+
+
+@pytest.fixture(scope='module')
+def cube():
+    return simd_data.build_share_cube(simd_data.load_ranks())
+
+
+def test_clientside_shares_match_server(cube):
+    # update_figures in assets/simd_clientside.js, from the table the
+    # browser is sent
+    table = simd_data.share_table(cube)
+    totals = np.array(table['totals'])
+    for (deprv_label, domain_rank, share_label), df_domain in cube.items():
+        counts = np.array(table['counts'][deprv_label][domain_rank])
+        shares = counts * 100 / (totals if share_label == 'local_share'
+                                 else counts.sum())
+        shares = np.floor(shares * 10 + 0.5) / 10  # Math.round
+        browser = pd.Series(shares, index=table['councils'])
+        server = df_domain[share_label]
+        assert browser.sort_values(ascending=False).tolist() == \
+            server.tolist()
+        assert browser.reindex(server.index).tolist() == server.tolist()
@@ -0,0 +1,75 @@
+'''
+Pins the share cube to the first dashboard's pandas computation.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import pandas as pd
+import pytest
+
+import simd_data
+
+DATASET = simd_data.DATASET
+GROUP = DATASET['group']
+
+
+@pytest.fixture(scope='module')
+def df():
+    return simd_data.load_ranks()
+
+
+@pytest.fixture(scope='module')
+def csv():
+    # the ranks as the first dashboard read them, not from the binary store
+    return pd.read_csv(DATASET['file'])
+
+
+@pytest.fixture(scope='module')
+def cube(df):
+    return simd_data.build_share_cube(df)
+
+
+def baseline_members(df, deprv_label, domain_rank):
+    # the level's datazones as the first dashboard selected them
+    level = simd_data.LEVELS[deprv_label]
+    n = round(simd_data.national_total(df) * level['fraction'])
+    if level['most_deprived']:
+        return df.nsmallest(n, domain_rank)
+    return df.nlargest(n, domain_rank)
+
+
+def baseline_table(df, deprv_label, domain_rank, share_label):
+    # update_figures' table before the share cube
+    datazones_per_council = df[GROUP].value_counts()
+    datazones_per_council.rename('Total_datazones', inplace=True)
+    deprv_by_domain = baseline_members(df, deprv_label, domain_rank)
+    domain_dz_per_council = deprv_by_domain[GROUP].value_counts()
+    domain_dz_per_council.rename(deprv_label, inplace=True)
+    df_domain = pd.concat([datazones_per_council, domain_dz_per_council],
+                          axis=1)
+    df_domain.fillna(0, inplace=True)
+    df_domain = df_domain.astype('int64')
+    if share_label == 'local_share':
+        df_domain[share_label] = df_domain[deprv_label] * 100 / \
+                                 df_domain['Total_datazones']
+    else:
+        df_domain[share_label] = df_domain[deprv_label] * 100 / \
+                                 df_domain[deprv_label].sum()
+    df_domain = df_domain.round({share_label: 1})
+    df_domain.sort_values(by=share_label, ascending=False, inplace=True)
+    return df_domain
+
+
+def test_share_cube_matches_baseline(df, csv, cube):
+    keys = [(deprv_label, domain_rank, share_label)
+            for deprv_label in simd_data.deprv_features
+            for domain_rank in simd_data.rank_columns(df)
+            for share_label in simd_data.share_labels]
+    assert sorted(cube) == sorted(keys)
+    assert len(keys) == 112
+    for key in keys:
+        expected = baseline_table(csv, *key)
+        pd.testing.assert_frame_equal(cube[key], expected, check_dtype=False,
+                                      check_index_type=False,
+                                      check_names=False)
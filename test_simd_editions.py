@@ -0,0 +1,62 @@
+'''
+Behaviour of the edition change view: the movement of data zones between
+two editions, and its agreement with the share cube.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import numpy as np
+
+import simd_data
+import simd_editions
+
+
+def make_editions(ranks, totals, codes):
+    # two editions of one domain over the same data zones
+    return dict(year='2020', years=['2016', '2020'], domains=['SIMD_Rank'],
+                ranks=np.array(ranks, dtype=np.float32)[:, None, :],
+                totals=totals, councils=['A', 'B'], codes=np.array(codes))
+
+
+def test_movement_counts_entering_and_leaving():
+    editions = make_editions([[1, 2, 3, 4, 5, 6],
+                              [4, 1, 6, 2, 5, 3]], [6, 6],
+                             [0, 0, 0, 1, 1, 1])
+    df = simd_editions.movement(editions, 'SIMD_Rank', 0.5, True,
+                                '2016', '2020')
+    # 2016: zones 0, 1, 2 (all A); 2020: zones 1, 3, 5
+    assert df.loc['A'].tolist() == [3, 3, 1, 0, 2]
+    assert df.loc['B'].tolist() == [3, 0, 2, 2, 0]
+    assert list(df.columns) == ['Total_datazones', '2016', '2020',
+                                'entering', 'leaving']
+
+
+def test_ties_and_missing_ranks():
+    # tied ranks are taken in table order and a zone without a rank in an
+    # edition is never in its level
+    editions = make_editions([[np.nan, 1, 1, 3, 4, 5],
+                              [1, 1, 1, 4, 5, 6]], [5, 6],
+                             [0, 0, 0, 1, 1, 1])
+    before = simd_editions.members(editions, 'SIMD_Rank', 0.4, True, '2016')
+    after = simd_editions.members(editions, 'SIMD_Rank', 1 / 3, True, '2020')
+    assert before.tolist() == [False, True, True, False, False, False]
+    assert after.tolist() == [True, True, False, False, False, False]
+    least = simd_editions.members(editions, 'SIMD_Rank', 0.4, False, '2016')
+    assert least.tolist() == [False, False, False, False, True, True]
+
+
+def test_current_edition_matches_share_cube():
+    df = simd_data.load_ranks()
+    year = simd_data.DATASET['year']
+    editions = simd_editions.load_editions(df, year)
+    cube = simd_data.build_share_cube(df)
+    for deprv_label in simd_data.deprv_features:
+        fraction, most_deprived = simd_data.deprv_fraction(deprv_label)
+        for domain_rank in simd_data.rank_columns(df):
+            change = simd_editions.movement(
+                editions, simd_editions.domain_key(domain_rank, year),
+                fraction, most_deprived, year, year)
+            table = cube[(deprv_label, domain_rank, 'local_share')]
+            assert change[year].reindex(table.index).tolist() == \
+                table[deprv_label].tolist()
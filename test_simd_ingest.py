@@ -0,0 +1,84 @@
+'''
+Behaviour of the analyses ingest: finding the per-council table in a
+hand-made sheet, and converting and listing the sheets of a directory.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import simd_ingest
+
+NAMES = {'Glasgow City', 'Inverclyde', 'Fife'}
+
+
+def make_cells(rows):
+    return pd.DataFrame(rows, dtype=object)
+
+
+def test_tidy_sheet_drops_titles_and_totals():
+    cells = make_cells([
+        ['Health analysis 2020', None, None, None],
+        [None, None, None, None],
+        ['Council', 'Data  zones', None, 'local share'],
+        ['Glasgow City', '746', None, '18.4'],
+        ['Inverclyde', '114', None, '19.3'],
+        ['Fife', '494', None, None],
+        ['Total', '1354', None, '37.7'],
+        ['Scotland', '6976', None, '100'],
+        ['Source: SIMD 2020', None, None, None],
+    ])
+    table, unknown = simd_ingest.tidy_sheet(cells, NAMES)
+    assert unknown == []
+    assert table.index.name == simd_ingest.simd_data.DATASET['group']
+    assert list(table.columns) == ['Data zones', 'local share']
+    assert table.loc['Glasgow City'].tolist() == [746, 18.4]
+    assert pd.isna(table.loc['Fife', 'local share'])
+
+
+def test_tidy_sheet_reports_unknown_names():
+    cells = make_cells([['Council', 'Count'], ['Glasgow', '1'],
+                        ['Fife', '2'], ['Inverclyde', '3']])
+    table, unknown = simd_ingest.tidy_sheet(cells, NAMES)
+    assert unknown == ['Glasgow']
+
+
+@pytest.mark.parametrize('rows, problem', [
+    ([[None, None]], 'empty sheet'),
+    ([['a', '1'], ['b', '2']], 'no column of'),
+    ([['Fife', '1'], ['Fife', '2']], 'not one row per'),
+])
+def test_tidy_sheet_rejects(rows, problem):
+    with pytest.raises(ValueError, match=problem):
+        simd_ingest.tidy_sheet(make_cells(rows), NAMES)
+
+
+def test_ingest_lists_and_updates_stores(tmp_path):
+    source, output = tmp_path / 'source', tmp_path / 'analyses'
+    source.mkdir()
+    shutil.copy('deprv5_by_total.csv', source)
+    failed = {}
+    entries = simd_ingest.ingest([str(source)], str(output), failed)
+    assert [entry['name'] for entry in entries] == ['deprv5_by_total']
+    table = simd_ingest.load_analyses(str(output))['deprv5_by_total']['table']
+    assert table.loc['Inverclyde', '5% most deprived'] == 22
+
+    # a council name typo keeps the last good store and is reported
+    path = source / 'deprv5_by_total.csv'
+    text = path.read_text()
+    path.write_text(text.replace('Glasgow City', 'Glasgow'))
+    assert simd_ingest.ingest([str(source)], str(output), failed) == entries
+    assert 'Glasgow' in failed[str(path)][1]
+
+    # fixed: a new store replaces the old one
+    path.write_text(text.replace('114,22', '114,23'))
+    new = simd_ingest.ingest([str(source)], str(output), failed)
+    assert new[0]['store'] != entries[0]['store']
+    assert sorted(os.listdir(output)) == sorted([new[0]['store'],
+                                                 simd_ingest.INDEX_FILE])
+    assert not failed
@@ -0,0 +1,57 @@
+'''
+Behaviour of the point in polygon lookup: even-odd ray casting, holes,
+multipolygons and points in more than one polygon.
+
+    python -m pytest -q
+'''
+import simd_lookup
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size],
+            [x, y]]
+
+
+def feature(name, geometry_type, coordinates):
+    return dict(properties=dict(Name=name),
+                geometry=dict(type=geometry_type, coordinates=coordinates))
+
+
+def make_index(strips=4):
+    return simd_lookup.build_index([
+        # a square with a square hole
+        feature('holed', 'Polygon', [square(0, 0, 4), square(1, 1, 2)]),
+        # two islands
+        feature('islands', 'MultiPolygon', [[square(5, 0, 1)],
+                                            [square(5, 3, 1)]]),
+        # overlaps the second island
+        feature('overlap', 'Polygon', [square(5.5, 3, 2)]),
+    ], 'Name', strips)
+
+
+def test_locate_even_odd():
+    index = make_index()
+    points = [(0.5, 0.5, 'holed'), (3.5, 2, 'holed'), (2, 2, None),
+              (5.5, 0.5, 'islands'), (5.2, 3.5, 'islands'),
+              (7, 4, 'overlap'), (4.5, 0.5, None), (5.5, 2, None),
+              (2, -1, None), (2, 10, None)]
+    found = simd_lookup.locate(index, [p[0] for p in points],
+                               [p[1] for p in points])
+    assert [index['names'][i] if i >= 0 else None for i in found] == \
+        [p[2] for p in points]
+
+
+def test_point_in_two_polygons_goes_to_the_first():
+    index = make_index()
+    assert index['names'][simd_lookup.locate(index, [5.75], [3.5])[0]] == \
+        'islands'
+
+
+def test_batches_and_strips_give_the_same_result(monkeypatch):
+    lon = [i / 10 for i in range(-5, 85)] * 5
+    lat = [j / 5 for j in range(-1, 24) for _ in range(18)]
+    expected = simd_lookup.locate(make_index(strips=1), lon, lat)
+    monkeypatch.setattr(simd_lookup, 'BATCH', 7)
+    assert simd_lookup.locate(make_index(strips=64), lon, lat).tolist() == \
+        expected.tolist()
+    assert (expected >= 0).any() and (expected < 0).any()
@@ -0,0 +1,65 @@
+'''
+Pins the domain overlap (simd_data.build_overlap) to direct pandas set and
+rank correlation computations.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import numpy as np
+import pytest
+
+import simd_data
+
+GROUP = simd_data.DATASET['group']
+
+
+@pytest.fixture(scope='module')
+def df():
+    return simd_data.load_ranks()
+
+
+@pytest.fixture(scope='module')
+def overlap(df):
+    return simd_data.build_overlap(df, simd_data.build_rank_bins(df))
+
+
+def level_members(df, deprv_label, domain_rank):
+    # the level's datazones as the first dashboard selected them
+    level = simd_data.LEVELS[deprv_label]
+    n = round(simd_data.national_total(df) * level['fraction'])
+    if level['most_deprived']:
+        return set(df.nsmallest(n, domain_rank).index)
+    return set(df.nlargest(n, domain_rank).index)
+
+
+def groups(df, overlap):
+    # each council's datazones, then the whole dataset
+    return [df[df[GROUP] == council] for council in overlap['councils']] + \
+        [df]
+
+
+def test_jaccard_matches_sets(df, overlap):
+    domains = overlap['domains']
+    jaccard = simd_data.jaccard(overlap['counts'])
+    for l, deprv_label in enumerate(overlap['levels']):
+        members = {domain: level_members(df, deprv_label, domain)
+                   for domain in domains}
+        for c, group in enumerate(groups(df, overlap)):
+            rows = set(group.index)
+            for a, first in enumerate(domains):
+                for b, second in enumerate(domains):
+                    both = members[first] & members[second] & rows
+                    either = (members[first] | members[second]) & rows
+                    if either:
+                        assert jaccard[c, l, a, b] == pytest.approx(
+                            len(both) / len(either))
+                    else:
+                        assert np.isnan(jaccard[c, l, a, b])
+
+
+def test_spearman_matches_pandas(df, overlap):
+    for c, group in enumerate(groups(df, overlap)):
+        expected = group[overlap['domains']].corr(method='spearman').values
+        np.testing.assert_allclose(overlap['spearman'][c], expected,
+                                   atol=1e-9)
@@ -0,0 +1,39 @@
+'''
+Behaviour of the cumulative rank bins behind arbitrary cutoffs and the rank
+distributions.
+
+    python -m pytest -q
+'''
+import numpy as np
+import pandas as pd
+
+import simd_data
+
+DATASET = simd_data.DATASET
+DOMAIN = (DATASET['ranks'] or ['SIMD2020_Rank'])[0]
+
+
+def make_ranks():
+    # two councils and a tied .5 rank, the same in every domain
+    df = pd.DataFrame({DATASET['area']: ['z1', 'z2', 'z3', 'z4', 'z5'],
+                       DATASET['group']: ['A', 'A', 'B', 'B', 'B']})
+    for column in DATASET['ranks'] or [DOMAIN]:
+        df[column] = [1, 2.5, 2.5, 4, 5]
+    return df
+
+
+def test_histogram_counts_each_bin():
+    rank_bins = simd_data.build_rank_bins(make_ranks())
+    counts = simd_data.rank_histogram(rank_bins, DOMAIN,
+                                      np.array([0, 2, 3, 5]))
+    assert counts.tolist() == [[1, 1, 0], [0, 1, 2]]
+
+
+def test_edges_past_the_largest_rank():
+    # a schema total larger than the largest rank
+    rank_bins = simd_data.build_rank_bins(make_ranks())
+    counts = simd_data.rank_histogram(rank_bins, DOMAIN,
+                                      np.array([0, 4, 8, 12]))
+    assert counts.tolist() == [[2, 0, 0], [2, 1, 0]]
+    assert simd_data.threshold_counts(rank_bins, DOMAIN,
+                                      12).tolist() == [2, 3]
@@ -0,0 +1,52 @@
+'''
+Behaviour of the binary columnar store: a lossless round trip of the ranks
+table and the source hash check.
+
+    python -m pytest -q
+
+Run from the repository root, where the dataset paths are relative to.
+'''
+import pandas as pd
+
+import simd_data
+import simd_store
+
+
+def assert_same_values(stored, df):
+    # the store's columns are compact types on memory-mapped arrays
+    assert list(stored.columns) == list(df.columns)
+    for column in df.columns:
+        assert list(stored[column]) == list(df[column]), column
+
+
+def test_round_trip(tmp_path):
+    df = pd.DataFrame({'Data_Zone': ['S01', 'S02', 'S03', 'S04'],
+                       'Council_area': ['A', 'B', 'A', 'A'],
+                       'Rank': [3, 1, 4, 2],
+                       'Tied_Rank': [1.0, 2.5, 2.5, 4.0]})
+    path = str(tmp_path / 'table.store')
+    simd_store.write_store(df, path)
+    stored = simd_store.read_store(path)
+    assert stored['Council_area'].dtype == 'category'
+    assert stored['Rank'].dtype == 'int16'
+    assert stored['Tied_Rank'].dtype == 'float32'
+    assert_same_values(stored, df)
+
+
+def test_ranks_store_matches_csv():
+    csv = pd.read_csv(simd_data.DATA_FILE)
+    store = simd_store.read_store(simd_store.store_path(simd_data.DATA_FILE))
+    assert_same_values(store, csv)
+
+
+def test_is_fresh(tmp_path):
+    csv = tmp_path / 'ranks.csv'
+    csv.write_text('Data_Zone,Rank\nS01,1\nS02,2\n')
+    path = simd_store.store_path(str(csv))
+    assert not simd_store.is_fresh(str(csv), path)  # not built
+    simd_store.write_store(pd.read_csv(csv), path, source=str(csv))
+    assert simd_store.is_fresh(str(csv), path)
+    csv.write_text('Data_Zone,Rank\nS01,2\nS02,1\n')
+    assert not simd_store.is_fresh(str(csv), path)  # the CSV changed
+    csv.unlink()
+    assert simd_store.is_fresh(str(csv), path)  # shipped without the CSV